@@ -1,27 +1,262 @@
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 from datetime import datetime
 import re
 # import unicodedata
-import json
 import logging                                  # https://docs.python.org/3/howto/logging.html#logging-basic-tutorial
 # from datetime import datetime
-from typing import Dict
-from time import sleep
+from typing import Dict, List, Iterator, Tuple
+from time import sleep, monotonic
+import threading
+import random
 from sqlalchemy import create_engine, exc
 from sqlalchemy.sql import text
 from sqlalchemy.types import VARCHAR
 from sqlalchemy.orm.exc import NoResultFound
 from enum import Enum
+from functools import lru_cache
+from league_cache import ResponseCache, TTLCache
+from league_metrics import Metrics
 
 logging.basicConfig(filename='league_api.log', level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%d.%m.%Y %H:%M:%S')
 
+@lru_cache(maxsize=None)
+def _snake_case_columns(columns: tuple, prefix: str='') -> tuple:
+    # column names of a normalized payload -> table column names. cached per column layout,
+    # so the regex runs once per distinct layout instead of once per column and game
+    stripped = (column[len(prefix):] if prefix and column.startswith(prefix) else column for column in columns)
+    return tuple(re.sub(r'(?<!^)(?=[A-Z])', '_', column).lower() for column in stripped)
+
 class QueueType(Enum):
     RANKED_SOLO = 'RANKED_SOLO_5x5'
     RANKED_FLEX = 'RANKED_FLEX_SR'
 
+# riot game ids are only unique per platform. the stored game_id keys are the code of the platform
+# times GAME_ID_STRIDE plus the riot game id, so the codes must never change. EUW1 is 0, so keys
+# of databases and caches written before other platforms were supported stay valid.
+PLATFORMS = {'EUW1': 0, 'EUN1': 1, 'NA1': 2, 'KR': 3, 'BR1': 4, 'JP1': 5, 'LA1': 6, 'LA2': 7, 'OC1': 8, 'RU': 9, 'TR1': 10}
+PLATFORM_IDS = {code: platform_id for platform_id, code in PLATFORMS.items()}
+GAME_ID_STRIDE = 10 ** 11
+
+def namespace_game_id(platform_id: str, game_id: int) -> int:
+    return PLATFORMS[platform_id.upper()] * GAME_ID_STRIDE + int(game_id)
+
+def split_game_id(key) -> Tuple[str, int]:
+    # (platform_id, riot game id) of a game_id key
+    code, game_id = divmod(int(key), GAME_ID_STRIDE)
+    return PLATFORM_IDS[code], game_id
+
+def _namespace_game_ids(frame: pd.DataFrame, platform_id: str) -> pd.Series:
+    # game_id keys of a frame with the riot game_id and platform_id columns of match-v4 payloads
+    platforms = frame.platform_id.str.upper() if 'platform_id' in frame else pd.Series(platform_id, index=frame.index)
+    codes = platforms.map(PLATFORMS)
+    if codes.isna().any():
+        raise ValueError('unknown platform {0}'.format(', '.join(platforms[codes.isna()].unique())))
+    return codes.astype('int64') * GAME_ID_STRIDE + frame.game_id.astype('int64')
+
+# value sets of the low cardinality columns of match-v4 payloads. names equal values,
+# so the database enums and the categoricals emitted by the parsers hold the same labels
+class EventType(Enum):
+    CHAMPION_KILL = 'CHAMPION_KILL'
+    WARD_PLACED = 'WARD_PLACED'
+    WARD_KILL = 'WARD_KILL'
+    BUILDING_KILL = 'BUILDING_KILL'
+    ELITE_MONSTER_KILL = 'ELITE_MONSTER_KILL'
+    ITEM_PURCHASED = 'ITEM_PURCHASED'
+    ITEM_SOLD = 'ITEM_SOLD'
+    ITEM_DESTROYED = 'ITEM_DESTROYED'
+    ITEM_UNDO = 'ITEM_UNDO'
+    SKILL_LEVEL_UP = 'SKILL_LEVEL_UP'
+    ASCENDED_EVENT = 'ASCENDED_EVENT'
+    CAPTURE_POINT = 'CAPTURE_POINT'
+    PORO_KING_SUMMON = 'PORO_KING_SUMMON'
+
+class LevelUpType(Enum):
+    NORMAL = 'NORMAL'
+    EVOLVE = 'EVOLVE'
+
+class WardType(Enum):
+    YELLOW_TRINKET = 'YELLOW_TRINKET'
+    YELLOW_TRINKET_UPGRADE = 'YELLOW_TRINKET_UPGRADE'
+    BLUE_TRINKET = 'BLUE_TRINKET'
+    SIGHT_WARD = 'SIGHT_WARD'
+    VISION_WARD = 'VISION_WARD'
+    CONTROL_WARD = 'CONTROL_WARD'
+    TEEMO_MUSHROOM = 'TEEMO_MUSHROOM'
+    UNDEFINED = 'UNDEFINED'
+
+class MonsterType(Enum):
+    DRAGON = 'DRAGON'
+    BARON_NASHOR = 'BARON_NASHOR'
+    RIFTHERALD = 'RIFTHERALD'
+    ELDER_DRAGON = 'ELDER_DRAGON'
+
+class MonsterSubType(Enum):
+    AIR_DRAGON = 'AIR_DRAGON'
+    EARTH_DRAGON = 'EARTH_DRAGON'
+    FIRE_DRAGON = 'FIRE_DRAGON'
+    WATER_DRAGON = 'WATER_DRAGON'
+    ELDER_DRAGON = 'ELDER_DRAGON'
+
+class BuildingType(Enum):
+    TOWER_BUILDING = 'TOWER_BUILDING'
+    INHIBITOR_BUILDING = 'INHIBITOR_BUILDING'
+
+class LaneType(Enum):
+    TOP_LANE = 'TOP_LANE'
+    MID_LANE = 'MID_LANE'
+    BOT_LANE = 'BOT_LANE'
+
+class TowerType(Enum):
+    OUTER_TURRET = 'OUTER_TURRET'
+    INNER_TURRET = 'INNER_TURRET'
+    BASE_TURRET = 'BASE_TURRET'
+    NEXUS_TURRET = 'NEXUS_TURRET'
+    UNDEFINED_TURRET = 'UNDEFINED_TURRET'
+
+class Lane(Enum):
+    TOP = 'TOP'
+    JUNGLE = 'JUNGLE'
+    MIDDLE = 'MIDDLE'
+    MID = 'MID'
+    BOTTOM = 'BOTTOM'
+    BOT = 'BOT'
+    NONE = 'NONE'
+
+class Role(Enum):
+    SOLO = 'SOLO'
+    DUO = 'DUO'
+    DUO_CARRY = 'DUO_CARRY'
+    DUO_SUPPORT = 'DUO_SUPPORT'
+    NONE = 'NONE'
+
+EVENT_CATEGORIES = {'type': EventType, 'level_up_type': LevelUpType, 'ward_type': WardType, 'monster_type': MonsterType, 'monster_sub_type': MonsterSubType,
+                    'building_type': BuildingType, 'lane_type': LaneType, 'tower_type': TowerType}
+STATS_CATEGORIES = {'lane': Lane, 'role': Role}
+# numeric event columns that are missing on most events, emitted as nullable integers instead of floats
+EVENT_INTEGER_COLUMNS = ('skill_slot', 'item_id', 'creator_id', 'killer_id', 'victim_id', 'position_x', 'position_y', 'after_id', 'before_id', 'team_id')
+
+def _categorize(frame: pd.DataFrame, categories: Dict[str, type]) -> None:
+    # labels outside of the enum would silently become nulls, so they are rejected
+    for column, enum in categories.items():
+        if column in frame:
+            labels = [member.value for member in enum]
+            unknown = set(frame[column].dropna().unique()) - set(labels)
+            if unknown:
+                raise ValueError('unknown {0} {1}, add them to {2}'.format(column, ', '.join(map(str, sorted(unknown))), enum.__name__))
+            frame[column] = pd.Categorical(frame[column], categories=labels)
+
+class RateLimit:
+    # token bucket for one 'limit:window' pair of a riot rate limit header.
+    # riot counts requests in fixed windows, so the bucket is refilled completely
+    # once the window that was opened by the first request has passed.
+    def __init__(self, limit: int, window: int, margin: float=0.05) -> None:
+        self.limit = limit
+        self.window = window
+        self.margin = margin
+        self.tokens = limit
+        self.window_start = None
+
+    def __refill(self, now: float) -> None:
+        if self.window_start is not None and now >= self.window_start + self.window + self.margin:
+            self.tokens = self.limit
+            self.window_start = None
+
+    def wait_time(self, now: float) -> float:
+        self.__refill(now)
+        if self.tokens > 0:
+            return 0.0
+        return self.window_start + self.window + self.margin - now
+
+    def take(self, now: float) -> None:
+        if self.window_start is None:
+            self.window_start = now
+        self.tokens -= 1
+
+    def sync(self, count: int, now: float) -> None:
+        # count is the number of requests riot has seen in the current window
+        self.__refill(now)
+        if count == 1 or self.window_start is None:
+            # the response is later than the moment riot opened the window
+            self.window_start = now
+        self.tokens = min(self.tokens, self.limit - count)
+
+
+class RateLimiter:
+    def __init__(self, app_limits: str='20:1,100:120', method_limits: Dict[str, str]=None) -> None:
+        self.lock = threading.Lock()
+        self.app = self.__parse_limits(app_limits)
+        self.methods = {endpoint: self.__parse_limits(limits) for endpoint, limits in (method_limits or {}).items()}
+        self.blocked_until = {}
+
+    @staticmethod
+    def __parse_header(value: str) -> Dict[int, int]:
+        # '20:1,100:120' -> {1: 20, 120: 100}
+        pairs = (item.split(':') for item in value.split(',') if item)
+        return {int(window): int(amount) for amount, window in pairs}
+
+    def __parse_limits(self, value: str) -> List[RateLimit]:
+        return [RateLimit(limit, window) for window, limit in sorted(self.__parse_header(value).items())]
+
+    def __sync(self, buckets: List[RateLimit], limits: str, counts: str, now: float) -> List[RateLimit]:
+        if limits is not None:
+            windows = self.__parse_header(limits)
+            if windows != {bucket.window: bucket.limit for bucket in buckets}:
+                buckets = [RateLimit(limit, window) for window, limit in sorted(windows.items())]
+        if counts is not None:
+            counted = self.__parse_header(counts)
+            for bucket in buckets:
+                if bucket.window in counted:
+                    bucket.sync(counted[bucket.window], now)
+        return buckets
+
+    def reserve(self, endpoint: str) -> float:
+        # takes a token from every bucket of the endpoint or returns the seconds to wait
+        with self.lock:
+            now = monotonic()
+            buckets = self.app + self.methods.get(endpoint, [])
+            waits = [bucket.wait_time(now) for bucket in buckets]
+            waits.append(self.blocked_until.get('application', 0) - now)
+            waits.append(self.blocked_until.get(endpoint, 0) - now)
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            for bucket in buckets:
+                bucket.take(now)
+            return 0.0
+
+    def acquire(self, endpoint: str) -> None:
+        wait = self.reserve(endpoint)
+        while wait > 0:
+            sleep(wait)
+            wait = self.reserve(endpoint)
+
+    def update(self, endpoint: str, headers: Dict[str, str]) -> None:
+        with self.lock:
+            now = monotonic()
+            self.app = self.__sync(self.app, headers.get('X-App-Rate-Limit'), headers.get('X-App-Rate-Limit-Count'), now)
+            self.methods[endpoint] = self.__sync(self.methods.get(endpoint, []), headers.get('X-Method-Rate-Limit'), headers.get('X-Method-Rate-Limit-Count'), now)
+
+    def penalize(self, endpoint: str, headers: Dict[str, str], default_delay: float=1.0) -> float:
+        # 429: nothing is sent to the limited scope until Retry-After has passed
+        delay = float(headers.get('Retry-After', default_delay))
+        scope = 'application' if headers.get('X-Rate-Limit-Type') == 'application' else endpoint
+        with self.lock:
+            self.blocked_until[scope] = max(self.blocked_until.get(scope, 0), monotonic() + delay)
+        return delay
+
+
 class RiotApi:
-    def __init__(self, api_key: str) -> None:
+    # a client of one platform (EUW1, NA1, KR, ...), its limiter holds the rate budget of that platform.
+    # base_url defaults to the host of the platform, game ids are the keys of namespace_game_id.
+    def __init__(self, api_key: str, rate_limits: str='20:1,100:120', base_url: str=None, limiter: RateLimiter=None,
+                 pool_size: int=10, timeout: tuple=(3.05, 30), max_retries: int=5, backoff_factor: float=0.5, backoff_max: float=60,
+                 cache: ResponseCache=None, offline: bool=False, memo: TTLCache=None, metrics: Metrics=None,
+                 static_url: str='http://static.developer.riotgames.com', ddragon_url: str='http://ddragon.leagueoflegends.com', platform: str='EUW1') -> None:
+        if platform.upper() not in PLATFORMS:
+            raise ValueError('platform must be one of {0}'.format(', '.join(PLATFORMS)))
+        self.platform = platform.upper()
         self.key = api_key
         self.header = {
             'Origin': 'https://developer.riotgames.com',
@@ -29,44 +264,202 @@ class RiotApi:
         }
         self.query_delay_time = 100
         self.version = '10.23.1'
+        self.base_url = base_url if base_url is not None else 'https://{0}.api.riotgames.com'.format(self.platform.lower())
+        self.static_url = static_url
+        self.ddragon_url = ddragon_url
+        self.limiter = limiter if limiter is not None else RateLimiter(rate_limits)
+
+        # one keep-alive session for all requests, so tcp and tls handshakes are paid once per pooled connection
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # retry policy for 429 and 5xx responses: exponential backoff with full jitter
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+
+        # raw match and timeline payloads are cached, in offline mode nothing but the cache is read
+        self.cache = cache
+        self.offline = offline
+        # summoners, leaderboards and static data are memoized with a time to live per endpoint
+        self.memo = memo if memo is not None else TTLCache()
+
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'latency_total': 0.0, 'latency_max': 0.0, 'latency_last': 0.0}
+        # per endpoint request counts by status, latency histograms and time spent waiting for the rate limit and in backoff
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def __get(self, url: str, endpoint: str, **kwargs) -> requests.Response:
+        start = monotonic()
+        r = self.session.get(url, timeout=self.timeout, **kwargs)
+        self._record_request(endpoint, r.status_code, monotonic() - start)
+        return r
+
+    def _record_request(self, endpoint: str, status: int, latency: float) -> None:
+        self.metrics.inc('riot_requests_total', endpoint=endpoint, status=status)
+        self.metrics.observe('riot_request_seconds', latency, endpoint=endpoint)
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['latency_total'] += latency
+            self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+            self.stats['latency_last'] = latency
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt))
+
+    def get_connection_stats(self) -> Dict[str, float]:
+        # urllib3 counts every connection it opens, all other requests reused a pooled connection
+        connections = 0
+        for adapter in self.session.adapters.values():
+            pools = adapter.poolmanager.pools
+            connections += sum(pools[key].num_connections for key in pools.keys())
+        return self._summarize_stats(connections)
+
+    def _summarize_stats(self, connections: int) -> Dict[str, float]:
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['new_connections'] = connections
+        stats['reused_connections'] = max(0, stats['requests'] - connections)
+        stats['latency_avg'] = stats['latency_total'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
 
     def __snake_case(self, camel_case: str) -> str:
-        return re.sub(r'(?<!^)(?=[A-Z])', '_', camel_case).lower()
-
-    def __post_query(self, query: str, is_first_run: bool=True) -> dict:
-        sleep(0.2)
-        r = requests.get(query, headers=self.header)
-        if r.status_code == 200:
-            return r.json()
-        elif r.status_code == 403:
+        return _snake_case_columns((camel_case,))[0]
+
+    def _connection_error_delay(self, error: Exception, query: str, endpoint: str, attempt: int) -> float:
+        self.metrics.inc('riot_requests_total', endpoint=endpoint, status=type(error).__name__)
+        if attempt == self.max_retries:
+            logging.error('{0} on requesting {1}'.format(type(error).__name__, query))
+            raise error
+        delay = self._backoff(attempt)
+        self.metrics.inc('riot_backoff_seconds_total', delay, endpoint=endpoint)
+        logging.warning('{0} on requesting {1}. Retry in {2:.2f} seconds.'.format(type(error).__name__, query, delay))
+        return delay
+
+    def _retry_delay(self, status: int, headers: Dict[str, str], query: str, endpoint: str, attempt: int) -> float:
+        # raises for responses that must not be retried, otherwise returns the seconds to sleep before the next attempt
+        if status == 403:
             logging.error('Forbidden request. Api key is not valid.')
             raise Exception('Forbidden request. Api key is not valid.')
-        elif r.status_code == 504:
-            sleep(5)
-            try:
-                r = requests.get(query, headers=self.header)
-                return r.json()
-            except Exception:
-                logging.error('Gateway timeout')
-                raise Exception('Gateway timeout...')
-        elif r.status_code == 404:
+        elif status == 404:
             # no data found
             raise NoResultFound('No results from request.')
-        elif r.status_code == 429 and is_first_run:
-            logging.warning('Rate limit exceeded. Sleep 121 seconds.')
-            sleep(125)
+        elif status != 429 and status < 500:
+            raise Exception('code {0} error on requesting {1}'.format(status, query))
+        elif attempt == self.max_retries:
+            logging.error('code {0} error on requesting {1} after {2} retries'.format(status, query, self.max_retries))
+            raise Exception('code {0} error on requesting {1} after {2} retries'.format(status, query, self.max_retries))
+
+        with self.stats_lock:
+            self.stats['retries'] += 1
+        delay = self._backoff(attempt)
+        if status == 429:
+            # Retry-After blocks the limited scope in the limiter, the next acquire waits for it
+            delay = self.limiter.penalize(endpoint, headers, default_delay=delay)
+            logging.warning('Rate limit exceeded ({0}). Retry after {1:.2f} seconds.'.format(headers.get('X-Rate-Limit-Type', 'service'), delay))
+            return 0.0
+        logging.warning('code {0} on requesting {1}. Retry in {2:.2f} seconds.'.format(status, query, delay))
+        self.metrics.inc('riot_backoff_seconds_total', delay, endpoint=endpoint)
+        return delay
+
+    def _cache_get(self, endpoint: str, match_id: str) -> dict:
+        result = self.cache.get(endpoint, match_id) if self.cache is not None else None
+        if result is None and self.offline:
+            raise NoResultFound('No cached {0} for game_id {1} in offline mode.'.format(endpoint, match_id))
+        return result
+
+    def _cache_put(self, endpoint: str, match_id: str, result: dict) -> None:
+        if self.cache is not None:
+            self.cache.put(endpoint, match_id, result)
+
+    def _memo_get(self, endpoint: str, key: str) -> dict:
+        entry = self.memo.lookup(endpoint, key)
+        return entry['value'] if self.memo.is_fresh(entry) else None
+
+    def get_cache_stats(self) -> Dict[str, dict]:
+        return {'memo': self.memo.get_stats(), 'responses': self.cache.get_stats() if self.cache is not None else {}}
+
+    def __get_static(self, endpoint: str, url: str) -> dict:
+        # static data from the cdns, revalidated with ETag / Last-Modified once the ttl expired
+        entry = self.memo.lookup(endpoint, url)
+        if self.memo.is_fresh(entry) or (entry is not None and self.offline):
+            return entry['value']
+        self._check_online(url)
+        headers = {}
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        r = self.__get(url, endpoint, headers=headers)
+        if r.status_code == 304 and entry is not None:
+            self.memo.revalidate(endpoint, url)
+            return entry['value']
+        r.raise_for_status()
+        result = r.json()
+        self.memo.store(endpoint, url, result, etag=r.headers.get('ETag'), last_modified=r.headers.get('Last-Modified'))
+        return result
+
+    def _check_online(self, query: str) -> None:
+        if self.offline:
+            raise Exception('offline mode, not requesting {0}'.format(query))
+
+    def __post_query(self, query: str, endpoint: str) -> dict:
+        self._check_online(query)
+        for attempt in range(self.max_retries + 1):
+            start = monotonic()
+            self.limiter.acquire(endpoint)
+            self.metrics.inc('riot_rate_limit_wait_seconds_total', monotonic() - start, endpoint=endpoint)
             try:
-                r = requests.get(query, headers=self.header, is_first_run=False)
+                r = self.__get(query, endpoint, headers=self.header)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                sleep(self._connection_error_delay(e, query, endpoint, attempt))
+                continue
+
+            self.limiter.update(endpoint, r.headers)
+            if r.status_code == 200:
                 return r.json()
-            except Exception:
-                if r.status_code != 200:
-                    logging.error('Repeated Error after rate limited exceeded and 120 seconds timeout')
-                    raise Exception('Repeated Error after rate limited exceeded and 120 seconds timeout')
-        else:
-            raise Exception('code {0} error on requesting {1}'.format(r.status_code, query))
+            sleep(self._retry_delay(r.status_code, r.headers, query, endpoint, attempt))
+
+    def _summoner_url(self, name: str) -> str:
+        return self.base_url+'/lol/summoner/v4/summoners/by-name/'+name
+
+    def _match_list_url(self, account_id: str, end_index: int=100, start_index: int=0, queue_id: int=-1, champion_id: int=-1, begin_time: datetime=None) -> str:
+        query = self.base_url+'/lol/match/v4/matchlists/by-account/'+account_id+'?beginIndex='+str(start_index)+'&endIndex='+str(end_index)
+        if begin_time is not None:
+            stamp = round(begin_time.timestamp()*1000)
+            query += '&beginTime={0}'.format(str(stamp))
+        if champion_id != -1:
+            query += '&champion='+str(champion_id)
+        if queue_id != -1:
+            query += '&queue='+str(queue_id)
+        return query
+
+    def _riot_game_id(self, match_id: str) -> int:
+        platform, game_id = split_game_id(match_id)
+        if platform != self.platform:
+            raise ValueError('game {0} belongs to platform {1}, not to {2}'.format(match_id, platform, self.platform))
+        return game_id
+
+    def _match_url(self, match_id: str) -> str:
+        return self.base_url+'/lol/match/v4/matches/'+str(self._riot_game_id(match_id))
+
+    def _timeline_url(self, match_id: str) -> str:
+        return self.base_url+'/lol/match/v4/timelines/by-match/'+str(self._riot_game_id(match_id))
+
+    def _leaderboard_url(self, queue_type: QueueType) -> str:
+        return self.base_url+'/lol/league/v4/challengerleagues/by-queue/{0}'.format(queue_type.value)
 
     def get_summoner_by_name(self, name: str) -> pd.DataFrame:
-        result = self.__post_query('https://euw1.api.riotgames.com/lol/summoner/v4/summoners/by-name/'+name)
+        result = self._memo_get('summoner', name)
+        if result is None:
+            result = self.__post_query(self._summoner_url(name), 'summoner')
+            self.memo.store('summoner', name, result)
+        return self.parse_summoner(result)
+
+    def parse_summoner(self, result: dict) -> pd.DataFrame:
         df_result = pd.json_normalize(result)
         df_result.columns = map(self.__snake_case, df_result.columns)
         df_result.rename({'id': 'summoner_id', 'name': 'summoner_name'}, axis=1, inplace=True)
@@ -75,58 +468,110 @@ class RiotApi:
         return df_result
 
     def get_match_list(self, account_id: str, end_index: int=100, start_index: int=0, queue_id: int=-1, champion_id: int=-1, full: bool=False, begin_time: datetime=None) -> pd.DataFrame:
-        query = 'https://euw1.api.riotgames.com/lol/match/v4/matchlists/by-account/'+account_id+'?beginIndex='+str(start_index)+'&endIndex='+str(end_index)
-        if begin_time is not None:
-            stamp = round(begin_time.timestamp()*1000)
-            query += '&beginTime={0}'.format(str(stamp))
-        if champion_id != -1:
-            query += '&champion='+str(champion_id)
-        if queue_id != -1:
-            query += '&queue='+str(queue_id)
-        result = self.__post_query(query)['matches']
-        df_matches = pd.json_normalize(result)
-        df_matches.columns = map(self.__snake_case, df_matches.columns)
+        if full:
+            return pd.concat(self.iter_match_list(account_id, page_size=end_index - start_index, start_index=start_index, queue_id=queue_id, champion_id=champion_id, begin_time=begin_time), ignore_index=True)
+        query = self._match_list_url(account_id, end_index=end_index, start_index=start_index, queue_id=queue_id, champion_id=champion_id, begin_time=begin_time)
+        return self.parse_match_list(self.__post_query(query, 'matchlist'))
 
-        if full and len(df_matches) > 0:
-            df_matches = pd.concat([df_matches, self.get_match_list(account_id, start_index=end_index, end_index=end_index+100, queue_id=queue_id, champion_id=champion_id, full=full)])
+    def iter_match_list(self, account_id: str, page_size: int=100, start_index: int=0, queue_id: int=-1, champion_id: int=-1, begin_time: datetime=None) -> Iterator[pd.DataFrame]:
+        # yields the match list one page at a time, the next page is requested when the consumer asks for it.
+        # no matches at all raise NoResultFound like get_match_list.
+        first = True
+        while True:
+            query = self._match_list_url(account_id, end_index=start_index + page_size, start_index=start_index, queue_id=queue_id, champion_id=champion_id, begin_time=begin_time)
+            try:
+                page = self.parse_match_list(self.__post_query(query, 'matchlist'))
+            except NoResultFound:
+                # riot answers a page behind the last match with 404
+                if first:
+                    raise
+                return
+            # a page behind the last match can also be answered with an empty list
+            if page.empty:
+                if first:
+                    raise NoResultFound('No results from request.')
+                return
+            yield page
+            # a short page is the last one
+            if len(page) < page_size:
+                return
+            first = False
+            start_index += page_size
 
+    def parse_match_list(self, result: dict) -> pd.DataFrame:
+        df_matches = pd.json_normalize(result['matches'])
+        df_matches.columns = map(self.__snake_case, df_matches.columns)
+        if not df_matches.empty:
+            df_matches['game_id'] = _namespace_game_ids(df_matches, self.platform)
         return df_matches
 
     def get_match_details(self, match_id: str) -> Dict[str, pd.DataFrame]:
-        result = self.__post_query('https://euw1.api.riotgames.com/lol/match/v4/matches/'+str(match_id))
+        return self.parse_match_details(self.get_match_raw(match_id))
+
+    def get_match_raw(self, match_id: str) -> dict:
+        result = self._cache_get('match', match_id)
+        if result is None:
+            result = self.__post_query(self._match_url(match_id), 'match')
+            self._cache_put('match', match_id, result)
+        return result
+
+    def parse_match_details(self, result: dict) -> Dict[str, pd.DataFrame]:
+        return self.parse_matches([result])
+
+    def parse_matches(self, results: List[dict]) -> Dict[str, pd.DataFrame]:
+        # matches, teams, bans, participants and stats of many match payloads, one frame per table
         frames = {}
-        frames.update(self.__extract_match_data(result))
-        frames.update(self.__extract_teams_data(result))
-        frames.update(self.__extract_bans_data(result))
-        frames.update(self.__extract_participants_data(result))
-        frames.update(self.__extract_stats_data(result))
+        with self.metrics.time('pyleague_stage_seconds', stage='parse_matches'):
+            results = [dict(result, gameId=namespace_game_id(result.get('platformId', self.platform), result['gameId'])) for result in results]
+            frames.update(self.__extract_match_data(results))
+            frames.update(self.__extract_teams_data(results))
+            frames.update(self.__extract_bans_data(results))
+            frames.update(self.__extract_participants_data(results))
+            frames.update(self.__extract_stats_data(results))
         return frames
 
     def get_timeline(self, match_id: str) -> Dict[str, pd.DataFrame]:
-        query = 'https://euw1.api.riotgames.com/lol/match/v4/timelines/by-match/'+str(match_id)
-        result = self.__post_query(query)
+        return self.parse_timeline(match_id, self.get_timeline_raw(match_id))
 
-        df_participants = pd.DataFrame()
-        df_events = pd.DataFrame()
+    def get_timeline_raw(self, match_id: str) -> dict:
+        result = self._cache_get('timeline', match_id)
+        if result is None:
+            result = self.__post_query(self._timeline_url(match_id), 'timeline')
+            self._cache_put('timeline', match_id, result)
+        return result
+
+    def parse_timeline(self, match_id: str, result: dict) -> Dict[str, pd.DataFrame]:
+        with self.metrics.time('pyleague_stage_seconds', stage='parse_timeline'):
+            return self.__parse_timeline(match_id, result)
+
+    def __parse_timeline(self, match_id: str, result: dict) -> Dict[str, pd.DataFrame]:
+        # collect all participant frames and events first and normalize each list once
+        participant_frames = []
+        events = []
         for frame in result['frames']:
             for participant in frame['participantFrames'].values():
-                buffer = pd.json_normalize(participant, sep='_')
-                buffer['timestamp'] = frame['timestamp']
-                df_participants = df_participants.append(buffer, ignore_index=True)
-            for event in frame['events']:
-                buffer = pd.json_normalize(event, sep='_')
-                df_events = df_events.append(buffer, ignore_index=True)
+                participant_frames.append(dict(participant, timestamp=frame['timestamp']))
+            events.extend(frame['events'])
 
+        df_participants = pd.json_normalize(participant_frames, sep='_')
         df_participants.columns = map(self.__snake_case, df_participants.columns)
-        df_participants['game_id'] = str(match_id)
+        df_participants['game_id'] = int(match_id)
         df_participants = df_participants.set_index(['game_id', 'timestamp', 'participant_id'])
 
-        df_events.columns =  map(self.__snake_case, df_events.columns)
-        df_events.participant_id = df_events.participant_id.fillna('0')
-        df_events['game_id'] = str(match_id)
+        df_events = pd.json_normalize(events, sep='_')
+        df_events.columns = map(self.__snake_case, df_events.columns)
+        df_events = df_events.reindex(columns=df_events.columns.union(['timestamp', 'participant_id', 'type'], sort=False))
+        df_events['participant_id'] = df_events.participant_id.fillna(0).astype('int64')
+        if 'assisting_participant_ids' in df_events:
+            df_events['assisting_participant_ids'] = df_events.assisting_participant_ids.map(lambda ids: ', '.join(map(str, ids)), na_action='ignore')
+        df_events['game_id'] = int(match_id)
         df_events['sequence'] = df_events.groupby(['game_id', 'timestamp', 'participant_id', 'type']).cumcount()
+        _categorize(df_events, EVENT_CATEGORIES)
+        for column in EVENT_INTEGER_COLUMNS:
+            if column in df_events:
+                df_events[column] = df_events[column].astype('Int64')
         df_events = df_events.set_index(['game_id', 'timestamp', 'participant_id', 'type'])
-        
+
         frames = {}
         frames.update({'timeline_participants': df_participants})
         frames.update({'timeline_events': df_events})
@@ -134,67 +579,65 @@ class RiotApi:
         return frames
 
     def get_leaderboard(self, queue_type: QueueType) -> pd.DataFrame:
-        query = 'https://euw1.api.riotgames.com/lol/league/v4/challengerleagues/by-queue/{0}'.format(queue_type.value)
-        result = self.__post_query(query)
+        result = self._memo_get('league', queue_type.value)
+        if result is None:
+            result = self.__post_query(self._leaderboard_url(queue_type), 'league')
+            self.memo.store('league', queue_type.value, result)
+        return self.parse_leaderboard(result)
+
+    def parse_leaderboard(self, result: dict) -> pd.DataFrame:
         result = pd.json_normalize(result, record_path='entries')
         result.columns = map(self.__snake_case, result.columns)
         result.set_index('summoner_id', inplace=True)
         return result
 
-    def __extract_match_data(self, data: json) -> Dict[str, pd.DataFrame]:
-        game = pd.json_normalize(data)
+    def __extract_match_data(self, data: List[dict]) -> Dict[str, pd.DataFrame]:
+        game = pd.DataFrame([{key: value for key, value in match.items() if key not in ('teams', 'participants', 'participantIdentities')} for match in data])
         game['gameCreation'] = pd.to_datetime(game['gameCreation'], unit='ms')
-        game = game.drop(columns=['teams', 'participants', 'participantIdentities'])
-        game.columns = map(self.__snake_case, game.columns)
+        game.columns = _snake_case_columns(tuple(game.columns))
         game = game.set_index('game_id')
         return {'matches': game}
 
-    def __extract_teams_data(self, data: json) -> Dict[str, pd.DataFrame]:
-        teams = pd.json_normalize(data, record_path=['teams'], meta='gameId', sep='_', max_level=0)
-        teams = teams.drop(columns=['bans'])
-        teams.columns = map(self.__snake_case, teams.columns)
+    def __extract_teams_data(self, data: List[dict]) -> Dict[str, pd.DataFrame]:
+        teams = pd.DataFrame([dict({key: value for key, value in team.items() if key != 'bans'}, gameId=match['gameId']) for match in data for team in match['teams']])
+        teams.columns = _snake_case_columns(tuple(teams.columns))
         teams = teams.set_index(['game_id', 'team_id'])
         return {'teams': teams}
 
-    def __extract_bans_data(self, data: json) -> Dict[str, pd.DataFrame]:
-        try:
-            bans = pd.json_normalize(data, record_path=['teams', 'bans'], meta=['gameId', ['teams', 'teamId']])
-            bans = bans.rename(columns={'teams.teamId': 'teamId'})
-            bans.columns = map(self.__snake_case, bans.columns)
-            bans = bans.set_index(['game_id', 'team_id', 'pick_turn'])
-            return {'bans': bans}
-        except KeyError:
+    def __extract_bans_data(self, data: List[dict]) -> Dict[str, pd.DataFrame]:
+        bans = [dict(ban, gameId=match['gameId'], teamId=team['teamId']) for match in data for team in match['teams'] for ban in team.get('bans', [])]
+        if not bans:
             return {'bans': pd.DataFrame()}
+        bans = pd.DataFrame(bans)
+        bans.columns = _snake_case_columns(tuple(bans.columns))
+        bans = bans.set_index(['game_id', 'team_id', 'pick_turn'])
+        return {'bans': bans}
 
-    def __extract_participants_data(self, data: json) -> Dict[str, pd.DataFrame]:
+    def __extract_participants_data(self, data: List[dict]) -> Dict[str, pd.DataFrame]:
         participants = pd.json_normalize(data, record_path=['participantIdentities'], meta=['gameId'])
-        participants.columns = map(lambda x: re.sub('player.', '', x), participants.columns)
-        participants.columns = map(self.__snake_case, participants.columns)
+        participants.columns = _snake_case_columns(tuple(participants.columns), 'player.')
         participants = participants.set_index(['game_id', 'participant_id'])
         #participants['summoner_name'] = participants['summoner_name'].apply(lambda val: unicodedata.normalize('NFKD', val).encode('ascii', 'ignore').decode())
         return {'participants': participants}
 
-    def __extract_stats_data(self, data: json) -> Dict[str, pd.DataFrame]:
+    def __extract_stats_data(self, data: List[dict]) -> Dict[str, pd.DataFrame]:
         stats = pd.json_normalize(data, record_path=['participants'], meta=['gameId'])
         stats = stats.rename(columns={'timeline.lane': 'lane', 'timeline.role': 'role'})
-        stats = stats.drop(columns=list(stats.filter(regex='timeline')))
-        stats = stats.drop(columns=['participantId'])
-        stats.columns = map(lambda x: re.sub('stats.', '', x), stats.columns)
-        stats.columns = map(self.__snake_case, stats.columns)
+        stats = stats.drop(columns=[column for column in stats.columns if 'timeline' in column] + ['participantId'])
+        stats.columns = _snake_case_columns(tuple(stats.columns), 'stats.')
+        _categorize(stats, STATS_CATEGORIES)
         stats = stats.set_index(['game_id', 'team_id', 'participant_id'])
         return {'stats': stats}
-    
+
     def get_queue_types(self) -> pd.DataFrame:
-        df_result = pd.read_json('http://static.developer.riotgames.com/docs/lol/queues.json')
+        df_result = pd.DataFrame(self.__get_static('queues', self.static_url+'/docs/lol/queues.json'))
         df_result.columns = map(self.__snake_case, df_result.columns)
         df_result = df_result.set_index('queue_id')
         return df_result
 
     def get_champion_json(self) -> pd.DataFrame:
-        content = requests.get('http://ddragon.leagueoflegends.com/cdn/{0}/data/en_US/champion.json'.format(self.version)).json()
-        table = pd.DataFrame()
-        for value in content['data'].values():
-            table = table.append(pd.json_normalize(value, sep='_'), ignore_index=True)
+        content = self.__get_static('champions', self.ddragon_url+'/cdn/{0}/data/en_US/champion.json'.format(self.version))
+        table = pd.json_normalize(list(content['data'].values()), sep='_')
         table.columns = map(self.__snake_case, table)
         table.columns = table.columns.str.replace('stats_', '')
         table.rename(columns={'key': 'champion_id'}, inplace=True)
@@ -0,0 +1,143 @@
+import asyncio
+from time import monotonic
+from datetime import datetime
+from typing import Dict, AsyncIterator
+import aiohttp
+from sqlalchemy.orm.exc import NoResultFound
+import pandas as pd
+from league_api import RiotApi, RateLimiter, QueueType
+from league_cache import ResponseCache, TTLCache
+from league_metrics import Metrics
+
+
+class AsyncRiotApi(RiotApi):
+    # asyncio counterpart of RiotApi. the riot endpoints are coroutines returning the same
+    # frames as RiotApi, the static data downloads (champions, queues) stay synchronous.
+    def __init__(self, api_key: str, rate_limits: str='20:1,100:120', base_url: str=None, limiter: RateLimiter=None,
+                 pool_size: int=10, timeout: tuple=(3.05, 30), max_retries: int=5, backoff_factor: float=0.5, backoff_max: float=60,
+                 cache: ResponseCache=None, offline: bool=False, memo: TTLCache=None, metrics: Metrics=None, platform: str='EUW1') -> None:
+        super().__init__(api_key, rate_limits=rate_limits, base_url=base_url, limiter=limiter, pool_size=pool_size, timeout=timeout,
+                         max_retries=max_retries, backoff_factor=backoff_factor, backoff_max=backoff_max, cache=cache, offline=offline, memo=memo,
+                         metrics=metrics, platform=platform)
+        self.pool_size = pool_size
+        self.http = None
+        self.connections = 0
+
+    async def __aenter__(self) -> 'AsyncRiotApi':
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self.http is not None:
+            await self.http.close()
+            self.http = None
+
+    async def __on_connection_create(self, session, context, params) -> None:
+        self.connections += 1
+
+    def __session(self) -> aiohttp.ClientSession:
+        # created lazily because aiohttp binds the session to the running event loop
+        if self.http is None:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self.__on_connection_create)
+            self.http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1]),
+                headers=self.header,
+                trace_configs=[trace])
+        return self.http
+
+    def get_connection_stats(self) -> Dict[str, float]:
+        return self._summarize_stats(self.connections)
+
+    async def __acquire(self, endpoint: str) -> None:
+        start = monotonic()
+        wait = self.limiter.reserve(endpoint)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.limiter.reserve(endpoint)
+        self.metrics.inc('riot_rate_limit_wait_seconds_total', monotonic() - start, endpoint=endpoint)
+
+    async def __post_query(self, query: str, endpoint: str) -> dict:
+        self._check_online(query)
+        session = self.__session()
+        for attempt in range(self.max_retries + 1):
+            await self.__acquire(endpoint)
+            try:
+                start = monotonic()
+                async with session.get(query) as r:
+                    status, headers = r.status, r.headers
+                    result = await r.json(content_type=None) if status == 200 else None
+                self._record_request(endpoint, status, monotonic() - start)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                await asyncio.sleep(self._connection_error_delay(e, query, endpoint, attempt))
+                continue
+
+            self.limiter.update(endpoint, headers)
+            if status == 200:
+                return result
+            await asyncio.sleep(self._retry_delay(status, headers, query, endpoint, attempt))
+
+    async def get_summoner_by_name(self, name: str) -> pd.DataFrame:
+        result = self._memo_get('summoner', name)
+        if result is None:
+            result = await self.__post_query(self._summoner_url(name), 'summoner')
+            self.memo.store('summoner', name, result)
+        return self.parse_summoner(result)
+
+    async def get_match_list(self, account_id: str, end_index: int=100, start_index: int=0, queue_id: int=-1, champion_id: int=-1, full: bool=False, begin_time: datetime=None) -> pd.DataFrame:
+        if full:
+            pages = self.iter_match_list(account_id, page_size=end_index - start_index, start_index=start_index, queue_id=queue_id, champion_id=champion_id, begin_time=begin_time)
+            return pd.concat([page async for page in pages], ignore_index=True)
+        query = self._match_list_url(account_id, end_index=end_index, start_index=start_index, queue_id=queue_id, champion_id=champion_id, begin_time=begin_time)
+        return self.parse_match_list(await self.__post_query(query, 'matchlist'))
+
+    async def iter_match_list(self, account_id: str, page_size: int=100, start_index: int=0, queue_id: int=-1, champion_id: int=-1, begin_time: datetime=None) -> AsyncIterator[pd.DataFrame]:
+        first = True
+        while True:
+            query = self._match_list_url(account_id, end_index=start_index + page_size, start_index=start_index, queue_id=queue_id, champion_id=champion_id, begin_time=begin_time)
+            try:
+                page = self.parse_match_list(await self.__post_query(query, 'matchlist'))
+            except NoResultFound:
+                if first:
+                    raise
+                return
+            # a page behind the last match can also be answered with an empty list
+            if page.empty:
+                if first:
+                    raise NoResultFound('No results from request.')
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            first = False
+            start_index += page_size
+
+    async def get_match_details(self, match_id: str) -> Dict[str, pd.DataFrame]:
+        return self.parse_match_details(await self.get_match_raw(match_id))
+
+    async def get_match_raw(self, match_id: str) -> dict:
+        result = self._cache_get('match', match_id)
+        if result is None:
+            result = await self.__post_query(self._match_url(match_id), 'match')
+            self._cache_put('match', match_id, result)
+        return result
+
+    async def get_timeline(self, match_id: str) -> Dict[str, pd.DataFrame]:
+        return self.parse_timeline(match_id, await self.get_timeline_raw(match_id))
+
+    async def get_timeline_raw(self, match_id: str) -> dict:
+        result = self._cache_get('timeline', match_id)
+        if result is None:
+            result = await self.__post_query(self._timeline_url(match_id), 'timeline')
+            self._cache_put('timeline', match_id, result)
+        return result
+
+    async def get_leaderboard(self, queue_type: QueueType) -> pd.DataFrame:
+        result = self._memo_get('league', queue_type.value)
+        if result is None:
+            result = await self.__post_query(self._leaderboard_url(queue_type), 'league')
+            self.memo.store('league', queue_type.value, result)
+        return self.parse_leaderboard(result)
@@ -0,0 +1,358 @@
+import argparse
+import inspect
+import json
+import logging
+import os
+import subprocess
+import tempfile
+from datetime import datetime
+from time import monotonic
+import pandas as pd
+from sqlalchemy import create_engine, func, select, inspect as inspect_db, MetaData, String
+import league_api as api
+import league_database as database
+from league_mock import MockRiotServer, generate_match, generate_timeline
+
+
+def benchmark_rate_limit(app_limits: str='20:1,100:10', duration: float=30.0) -> dict:
+    # sustained throughput of RiotApi against a mock server enforcing app_limits
+    with MockRiotServer(app_limits=app_limits) as server:
+        riot = api.RiotApi('benchmark', rate_limits=app_limits, base_url=server.url)
+        done = 0
+        start = monotonic()
+        while monotonic() - start < duration:
+            riot.get_summoner_by_name('player{0}'.format(done))
+            done += 1
+        elapsed = monotonic() - start
+        limit = min(int(amount) / int(window) for amount, window in (item.split(':') for item in app_limits.split(',')))
+        windows = max(int(item.split(':')[1]) for item in app_limits.split(','))
+        return {
+            'requests': done,
+            'seconds': round(elapsed, 2),
+            'requests_per_second': round(done / elapsed, 2),
+            'configured_per_second': round(limit, 2),
+            'utilization': round(done / elapsed / limit, 3),
+            'rejected_429': server.rejected,
+            'note': 'utilization includes the initial burst, run for several times {0}s to measure the sustained rate'.format(windows),
+        }
+
+
+def parse_timeline_per_row(match_id: str, result: dict) -> None:
+    # reference: the former parser normalizing and appending every participant frame and event on its own
+    df_participants = pd.DataFrame()
+    df_events = pd.DataFrame()
+    for frame in result['frames']:
+        for participant in frame['participantFrames'].values():
+            buffer = pd.json_normalize(participant, sep='_')
+            buffer['timestamp'] = frame['timestamp']
+            df_participants = pd.concat([df_participants, buffer], ignore_index=True)
+        for event in frame['events']:
+            df_events = pd.concat([df_events, pd.json_normalize(event, sep='_')], ignore_index=True)
+
+
+def benchmark_timeline(games: int=5, minutes: int=40) -> dict:
+    # parse time of the batched timeline parser against the per-row reference on generated timelines
+    riot = api.RiotApi('benchmark')
+    fixtures = [generate_timeline(game_id, minutes=minutes) for game_id in range(games)]
+    start = monotonic()
+    for game_id, fixture in enumerate(fixtures):
+        parse_timeline_per_row(game_id, fixture)
+    per_row = (monotonic() - start) / games
+    start = monotonic()
+    for game_id, fixture in enumerate(fixtures):
+        riot.parse_timeline(game_id, fixture)
+    batched = (monotonic() - start) / games
+    return {
+        'games': games,
+        'participant_rows_per_game': 10 * (minutes + 1),
+        'events_per_game': sum(len(frame['events']) for frame in fixtures[0]['frames']),
+        'per_row_seconds_per_game': round(per_row, 4),
+        'batched_seconds_per_game': round(batched, 4),
+        'speedup': round(per_row / batched, 1),
+    }
+
+
+def generated_frames(games: int) -> list:
+    riot = api.RiotApi('benchmark')
+    frames = []
+    for game_id in range(1, games + 1):
+        tables = riot.parse_match_details(generate_match(game_id))
+        tables.update(riot.parse_timeline(game_id, generate_timeline(game_id)))
+        database.denormalize_timelines(tables)
+        frames.append(tables)
+    return frames
+
+
+def ensure_scratch(con: str) -> None:
+    # the database benchmarks drop and recreate all tables of con, they refuse a database holding matches
+    engine = create_engine(con)
+    if inspect_db(engine).has_table(database.Match.__tablename__):
+        with engine.connect() as connection:
+            if connection.execute(select(func.count()).select_from(database.Match)).scalar():
+                raise SystemExit('{0} contains matches, the benchmark would drop all tables. use a scratch database or --force'.format(
+                    engine.url.render_as_string(hide_password=True)))
+
+
+def fresh_engine(con: str=None, metadata: MetaData=None):
+    # drops and recreates all tables of con, see ensure_scratch
+    if con is None:
+        con = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    metadata = metadata if metadata is not None else database.Base.metadata
+    engine = create_engine(con)
+    metadata.drop_all(engine)
+    database.Base.metadata.drop_all(engine)
+    metadata.create_all(engine)
+    return engine
+
+
+def benchmark_write(games: int=50, con: str=None) -> dict:
+    # rows/sec of per match and table to_sql appends against the bulk writer
+    frames = generated_frames(games)
+    rows = sum(len(table) for tables in frames for table in tables.values())
+
+    engine = fresh_engine(con)
+    start = monotonic()
+    for tables in frames:
+        for name, table in tables.items():
+            table.to_sql(name=name, con=engine, if_exists='append')
+    to_sql = monotonic() - start
+
+    engine = fresh_engine(con)
+    writer = database.BulkWriter(engine)
+    start = monotonic()
+    for tables in frames:
+        writer.add(tables)
+    writer.flush()
+    bulk = monotonic() - start
+    return {
+        'dialect': engine.dialect.name,
+        'games': games,
+        'rows': rows,
+        'to_sql_rows_per_second': round(rows / to_sql),
+        'bulk_rows_per_second': round(rows / bulk),
+        'speedup': round(to_sql / bulk, 1),
+    }
+
+
+# columns typed as strings before the compact layout
+LEGACY_STRING_COLUMNS = {
+    'matches': ['game_id', 'queue_id', 'map_id', 'season_id'],
+    'teams': ['game_id', 'team_id'],
+    'bans': ['game_id', 'team_id'],
+    'participants': ['game_id', 'participant_id'],
+    'stats': ['game_id', 'team_id', 'participant_id', 'role', 'lane'],
+    'timeline_participants': ['game_id', 'participant_id'],
+    'timeline_events': ['game_id', 'participant_id', 'type', 'skill_slot', 'level_up_type', 'item_id', 'ward_type', 'creator_id', 'killer_id',
+                        'victim_id', 'position_x', 'position_y', 'monster_type', 'after_id', 'before_id', 'team_id', 'building_type',
+                        'lane_type', 'tower_type', 'monster_sub_type'],
+}
+
+SCHEMA_QUERIES = {
+    'champion_gold': 'SELECT s.champion_id, AVG(s.gold_earned) FROM stats s JOIN participants p ON p.game_id = s.game_id AND p.participant_id = s.participant_id '
+                     'JOIN matches m ON m.game_id = s.game_id GROUP BY s.champion_id',
+    'item_purchases': "SELECT e.item_id, COUNT(*) FROM timeline_events e WHERE e.type = 'ITEM_PURCHASED' GROUP BY e.item_id",
+    'team_gold': 'SELECT s.team_id, AVG(tp.total_gold) FROM timeline_participants tp JOIN stats s ON s.game_id = tp.game_id AND s.participant_id = tp.participant_id '
+                 'GROUP BY s.team_id',
+}
+
+
+def legacy_metadata() -> MetaData:
+    # the match tables as they were laid out before integer keys and enums
+    metadata = MetaData()
+    for table in database.Base.metadata.sorted_tables:
+        legacy = table.to_metadata(metadata)
+        for name in LEGACY_STRING_COLUMNS.get(table.name, []):
+            legacy.c[name].type = String()
+    return metadata
+
+
+def database_size(engine) -> int:
+    with engine.connect() as connection:
+        if engine.dialect.name == 'postgresql':
+            return sum(connection.exec_driver_sql("SELECT pg_total_relation_size('{0}')".format(name)).scalar() for name in LEGACY_STRING_COLUMNS)
+        connection.exec_driver_sql('VACUUM')
+        return connection.exec_driver_sql('PRAGMA page_count').scalar() * connection.exec_driver_sql('PRAGMA page_size').scalar()
+
+
+def benchmark_schema(games: int=200, con: str=None, repeat: int=3) -> dict:
+    # size and query time of the former string keyed layout against the compact layout
+    frames = generated_frames(games)
+    result = {'games': games}
+    for layout, metadata in (('legacy', legacy_metadata()), ('compact', database.Base.metadata)):
+        engine = fresh_engine(con, metadata)
+        writer = database.BulkWriter(engine, metadata=metadata)
+        for tables in frames:
+            writer.add(tables)
+        writer.flush()
+        result['{0}_bytes'.format(layout)] = database_size(engine)
+        for name, query in SCHEMA_QUERIES.items():
+            timings = []
+            with engine.connect() as connection:
+                for _ in range(repeat):
+                    start = monotonic()
+                    connection.exec_driver_sql(query).all()
+                    timings.append(monotonic() - start)
+            result['{0}_{1}_seconds'.format(layout, name)] = round(min(timings), 4)
+        metadata.drop_all(engine)
+    result['size_ratio'] = round(result['legacy_bytes'] / result['compact_bytes'], 2)
+    return result
+
+
+TIMELINE_QUERIES = {
+    'item_purchases_of_champion_on_patch': "SELECT e.item_id, COUNT(*) FROM timeline_events e JOIN stats s ON s.game_id = e.game_id AND s.participant_id = e.participant_id "
+                                           "WHERE e.type = 'ITEM_PURCHASED' AND e.patch = '{patch}' AND s.champion_id = {champion} GROUP BY e.item_id",
+    'gold_at_15_minutes': 'SELECT participant_id, AVG(total_gold) FROM timeline_participants WHERE timestamp >= 900000 AND timestamp < 960000 GROUP BY participant_id',
+    'events_of_month': "SELECT type, COUNT(*) FROM timeline_events WHERE game_creation >= '{month}' GROUP BY type",
+}
+
+
+def benchmark_timeline_queries(games: int=200, con: str=None, repeat: int=3) -> dict:
+    # timeline access patterns with the primary key only, with the secondary indexes and, on postgres, partitioned by month and patch
+    frames = generated_frames(games)
+    stats = frames[0]['stats'].reset_index()
+    match = frames[0]['matches'].iloc[0]
+    queries = {name: query.format(champion=int(stats.champion_id.iloc[0]), patch='.'.join(match.game_version.split('.')[:2]),
+                                  month=match.game_creation.strftime('%Y-%m-01')) for name, query in TIMELINE_QUERIES.items()}
+    layouts = [('primary_key', None), ('indexed', None)]
+    if con is not None and create_engine(con).dialect.name == 'postgresql':
+        layouts += [('month', 'month'), ('patch', 'patch')]
+    result = {'games': games}
+    for layout, partition_by in layouts:
+        engine = fresh_engine(con)
+        partitions = database.TimelinePartitions(partition_by) if partition_by is not None else None
+        timelines = [database.Base.metadata.tables[name] for name in database.TIMELINE_TABLES]
+        if partitions is not None:
+            for table in reversed(timelines):
+                table.drop(engine)
+            partitions.create(engine)
+        elif layout == 'primary_key':
+            for table in timelines:
+                for index in table.indexes:
+                    index.drop(engine)
+        writer = database.BulkWriter(engine, partitions=partitions)
+        for tables in frames:
+            writer.add(tables)
+        writer.flush()
+        with engine.connect() as connection:
+            connection.exec_driver_sql('ANALYZE')
+            for name, query in queries.items():
+                timings = []
+                for _ in range(repeat):
+                    start = monotonic()
+                    connection.exec_driver_sql(query).all()
+                    timings.append(monotonic() - start)
+                result['{0}_{1}_seconds'.format(layout, name)] = round(min(timings), 4)
+    return result
+
+
+def _ingest(con: str, server: MockRiotServer, summoners: int, games: int) -> dict:
+    engine = fresh_engine(con)
+    db = database.LeagueDB(engine.url.render_as_string(hide_password=False), 'benchmark', base_url=server.url, limiter=api.RateLimiter('500:1,30000:600'))
+    db.api.static_url = db.api.ddragon_url = server.url
+    start = monotonic()
+    db.update_static_data()
+    static = monotonic() - start
+    start = monotonic()
+    for index in range(summoners):
+        db.update_summoner('player{0}'.format(index), number_of_games=games)
+    elapsed = monotonic() - start
+
+    with engine.connect() as connection:
+        matches = connection.execute(select(func.count()).select_from(database.Match)).scalar()
+    metrics = db.metrics.to_dict()
+    stages = {histogram['labels']['stage']: histogram['sum'] for histogram in metrics['histograms'] if histogram['name'] == 'pyleague_stage_seconds'}
+    result = {
+        'dialect': engine.dialect.name,
+        'static_data_seconds': round(static, 3),
+        'matches': matches,
+        'seconds': round(elapsed, 2),
+        'matches_per_second': round(matches / elapsed, 2),
+        'parse_seconds_per_match': round((stages.get('parse_matches', 0) + stages.get('parse_timeline', 0)) / max(matches, 1), 4),
+        'write_seconds_per_match': round(stages.get('write', 0) / max(matches, 1), 4),
+    }
+    for counter in metrics['counters']:
+        if counter['name'] == 'pyleague_table_write_seconds_total':
+            result['write_seconds_{0}'.format(counter['labels']['table'])] = round(counter['value'], 3)
+    return result
+
+
+def benchmark_ingest(con: str=None, summoners: int=5, games: int=50, latency: float=0.02, rate_429: float=0.0, rate_504: float=0.0) -> dict:
+    # update_static_data and update_summoner end to end against the mock server, on sqlite and on con when given.
+    # latency and injected 429/504 responses make the run include the waiting and retries of a real crawl
+    result = {'summoners': summoners, 'games': games, 'latency': latency, 'rate_429': rate_429, 'rate_504': rate_504}
+    with MockRiotServer(app_limits='500:1,30000:600', latency=latency, rate_429=rate_429, rate_504=rate_504, seed=0) as server:
+        for target in [None] + ([con] if con is not None else []):
+            run = _ingest(target, server, summoners, games)
+            dialect = run.pop('dialect')
+            result.update({'{0}_{1}'.format(dialect, key): value for key, value in run.items()})
+        result['injected_429'] = server.injected[429]
+        result['injected_504'] = server.injected[504]
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save_result(path: str, benchmark: str, result: dict, tolerance: float=0.1) -> list:
+    # appends the result as a json line and returns the regressions against the last saved run of the benchmark.
+    # a metric regressed when it is more than tolerance worse, rates are better when higher, seconds when lower
+    previous = None
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                entry = json.loads(line)
+                if entry['benchmark'] == benchmark:
+                    previous = entry
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps({'benchmark': benchmark, 'commit': git_commit(), 'timestamp': datetime.utcnow().isoformat(), 'result': result}) + '\n')
+
+    regressions = []
+    for key, value in (previous['result'].items() if previous is not None else []):
+        current = result.get(key)
+        if not isinstance(value, (int, float)) or not isinstance(current, (int, float)) or isinstance(value, bool) or not value:
+            continue
+        if key.endswith('per_second') or key == 'speedup':
+            change = (value - current) / value
+        elif 'seconds' in key:
+            change = (current - value) / value
+        else:
+            continue
+        if change > tolerance:
+            regressions.append('{0}: {1} -> {2}, {3:.0%} worse than {4}'.format(key, value, current, change, previous['commit']))
+    return regressions
+
+
+BENCHMARKS = {
+    'ingest': benchmark_ingest,
+    'ratelimit': benchmark_rate_limit,
+    'schema': benchmark_schema,
+    'timeline': benchmark_timeline,
+    'timeline_queries': benchmark_timeline_queries,
+    'write': benchmark_write,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pyleague benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--con', help='sqlalchemy url of a scratch database for database benchmarks, all its tables are dropped. '
+                                      'default is a temporary sqlite file')
+    parser.add_argument('--force', action='store_true', help='run on --con even when it contains matches')
+    parser.add_argument('--save', metavar='FILE', help='append the result to a json lines file and report regressions against the last saved run')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    benchmark = BENCHMARKS[args.benchmark]
+    kwargs = {'con': args.con} if args.con and 'con' in inspect.signature(benchmark).parameters else {}
+    if kwargs and not args.force:
+        ensure_scratch(args.con)
+    result = benchmark(**kwargs)
+    for key, value in result.items():
+        print('{0}: {1}'.format(key, value))
+    if args.save:
+        for regression in save_result(args.save, args.benchmark, result):
+            print('regression {0}'.format(regression))
@@ -0,0 +1,165 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from time import time
+
+
+class ResponseCache:
+    # content addressed on disk cache for payloads that never change, like finished matches and
+    # their timelines. entries are gzip compressed json files named by the sha1 of endpoint and key,
+    # the least recently used entries are evicted once the cache grows beyond max_bytes.
+    def __init__(self, directory: str, max_bytes: int=10 * 1024 ** 3) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # restore the lru order from the access times of a previous run
+        files = []
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.endswith('.json.gz'):
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_mtime, os.path.join(root, name), stat.st_size))
+        for _, path, size in sorted(files):
+            self.entries[path] = size
+            self.size += size
+
+    def __path(self, endpoint: str, key: str) -> str:
+        digest = hashlib.sha1('{0}/{1}'.format(endpoint, key).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.json.gz')
+
+    def get(self, endpoint: str, key: str) -> dict:
+        path = self.__path(endpoint, key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                payload = json.load(file)
+        except (FileNotFoundError, EOFError, ValueError, OSError):
+            with self.lock:
+                self.misses += 1
+            return None
+        os.utime(path)
+        with self.lock:
+            self.hits += 1
+            if path in self.entries:
+                self.entries.move_to_end(path)
+        return payload
+
+    def put(self, endpoint: str, key: str, payload: dict) -> None:
+        path = self.__path(endpoint, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = '{0}.{1}.tmp'.format(path, threading.get_ident())
+        with gzip.open(temporary, 'wt', encoding='utf-8') as file:
+            json.dump(payload, file, separators=(',', ':'))
+        os.replace(temporary, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            self.size += size - self.entries.pop(path, 0)
+            self.entries[path] = size
+            evicted = []
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                old_path, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                evicted.append(old_path)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    def rename(self, endpoint: str, key: str, new_key: str) -> bool:
+        # moves an entry to another key, e.g. when game ids are namespaced by platform
+        path, new_path = self.__path(endpoint, key), self.__path(endpoint, new_key)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        try:
+            os.replace(path, new_path)
+        except FileNotFoundError:
+            return False
+        with self.lock:
+            size = self.entries.pop(path, None)
+            if size is not None:
+                self.size -= self.entries.pop(new_path, 0)
+                self.entries[new_path] = size
+        return True
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+class TTLCache:
+    # in process cache for payloads that change rarely (summoners, leaderboards, static data) with a
+    # time to live per endpoint. with a directory the entries are also kept on disk and shared between
+    # runs. ETag and Last-Modified are stored with each entry, so expired entries can be revalidated.
+    DEFAULT_TTLS = {'summoner': 3600, 'league': 900, 'champions': 86400, 'queues': 86400}
+
+    def __init__(self, ttls: dict=None, directory: str=None) -> None:
+        self.ttls = dict(self.DEFAULT_TTLS, **(ttls or {}))
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.stats = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __path(self, endpoint: str, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1('{0}/{1}'.format(endpoint, key).encode()).hexdigest() + '.json')
+
+    def __count(self, endpoint: str, name: str) -> None:
+        counts = self.stats.setdefault(endpoint, {'hits': 0, 'misses': 0, 'revalidated': 0, 'refreshed': 0})
+        counts[name] += 1
+
+    def lookup(self, endpoint: str, key: str) -> dict:
+        # returns the entry, fresh or expired, or None
+        with self.lock:
+            entry = self.entries.get((endpoint, key))
+        if entry is None and self.directory is not None:
+            try:
+                with open(self.__path(endpoint, key), encoding='utf-8') as file:
+                    entry = json.load(file)
+                with self.lock:
+                    self.entries[(endpoint, key)] = entry
+            except (FileNotFoundError, ValueError):
+                pass
+        with self.lock:
+            self.__count(endpoint, 'hits' if self.is_fresh(entry) else 'misses')
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return entry is not None and entry['expires'] > time()
+
+    def store(self, endpoint: str, key: str, value, etag: str=None, last_modified: str=None) -> None:
+        entry = {'value': value, 'expires': time() + self.ttls.get(endpoint, 0), 'etag': etag, 'last_modified': last_modified}
+        with self.lock:
+            if (endpoint, key) in self.entries:
+                self.__count(endpoint, 'refreshed')
+            self.entries[(endpoint, key)] = entry
+        self.__save(endpoint, key, entry)
+
+    def revalidate(self, endpoint: str, key: str) -> None:
+        # the server answered 304, the cached value is valid for another ttl
+        with self.lock:
+            entry = self.entries[(endpoint, key)]
+            entry['expires'] = time() + self.ttls.get(endpoint, 0)
+            self.__count(endpoint, 'revalidated')
+        self.__save(endpoint, key, entry)
+
+    def __save(self, endpoint: str, key: str, entry: dict) -> None:
+        if self.directory is None:
+            return
+        path = self.__path(endpoint, key)
+        temporary = '{0}.{1}.tmp'.format(path, threading.get_ident())
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(entry, file)
+        os.replace(temporary, path)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {endpoint: dict(counts) for endpoint, counts in self.stats.items()}
@@ -0,0 +1,166 @@
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing.managers import BaseManager
+from time import monotonic
+from typing import Callable, Dict, List, Tuple
+import league_api as api
+import league_database as database
+from league_metrics import Metrics
+
+
+class LimiterManager(BaseManager):
+    # serves one RateLimiter to all worker processes, so they share the budget of the api key
+    pass
+
+LimiterManager.register('RateLimiter', api.RateLimiter)
+
+
+# LeagueDB of a worker process, created once by the pool initializer
+_db = None
+
+def _init_worker(con: str, api_key: str, limiter: api.RateLimiter, options: dict) -> None:
+    global _db
+    _db = database.LeagueDB(con, api_key, limiter=limiter, **options)
+
+def _crawl_summoner(summoner_name: str, number_of_games: int) -> Tuple[str, List[Tuple[str, str]]]:
+    # updates a summoner and returns its account_id and the (account_id, summoner_name) of its co-players.
+    # matches listed by several workers are fetched once, only one worker can claim their ingestion job.
+    _db.update_summoner(summoner_name, number_of_games=number_of_games)
+    try:
+        account_id = _db.api.get_summoner_by_name(summoner_name).index[0]
+    except Exception as e:
+        api.logging.error('summoner {0} is not crawled further: {1}'.format(summoner_name, str(e)))
+        return None, []
+    return account_id, list(_db.get_co_players(account_id).itertuples(index=False, name=None))
+
+
+class LadderCrawler:
+    # breadth first crawl starting at the challenger leaderboards and expanding through the
+    # account_ids of the participants of loaded matches. summoners are updated by a process pool,
+    # the parent process keeps the frontier and the set of summoners that were already queued.
+    def __init__(self, con: str, api_key: str, workers: int=4, rate_limits: str='20:1,100:120', number_of_games: int=100,
+                 report_interval: float=30, report: Callable[[Dict[str, float]], None]=None, **options) -> None:
+        self.con = con
+        self.api_key = api_key
+        self.workers = workers
+        self.rate_limits = rate_limits
+        self.number_of_games = number_of_games
+        self.report_interval = report_interval
+        self.report = report if report is not None else self._log_report
+        self.options = options
+
+    @staticmethod
+    def _log_report(stats: Dict[str, float]) -> None:
+        api.logging.info('crawler: ' + ', '.join('{0}={1}'.format(key, value) for key, value in stats.items()))
+
+    def __stats(self, db: database.LeagueDB, start: float, crawled: int, matches_before: int, frontier: int, in_flight: int) -> Dict[str, float]:
+        jobs = db.get_job_counts()
+        elapsed = max(monotonic() - start, 1e-9)
+        matches = jobs[database.JobState.DONE.value] - matches_before
+        return {
+            'seconds': round(elapsed, 1),
+            'summoners': crawled,
+            'summoners_per_second': round(crawled / elapsed, 3),
+            'matches': matches,
+            'matches_per_second': round(matches / elapsed, 3),
+            'frontier': frontier,
+            'in_flight': in_flight,
+            'pending_jobs': jobs[database.JobState.PENDING.value] + jobs[database.JobState.IN_PROGRESS.value],
+            'failed_jobs': jobs[database.JobState.FAILED.value],
+        }
+
+    def run(self, max_summoners: int=None) -> Dict[str, float]:
+        with LimiterManager() as manager:
+            limiter = manager.RateLimiter(self.rate_limits)
+            db = database.LeagueDB(self.con, self.api_key, limiter=limiter, **self.options)
+            seeds = db.get_ladder_summoners()
+            if not seeds:
+                db._update_challenger_leaderboard()
+                seeds = db.get_ladder_summoners()
+
+            frontier = deque(seeds)
+            names = {name.lower() for name in seeds}
+            accounts = set()
+            start = monotonic()
+            matches_before = db.get_job_counts()[database.JobState.DONE.value]
+            next_report = start + self.report_interval
+            submitted = crawled = 0
+
+            with ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.con, self.api_key, limiter, self.options)) as pool:
+                running = set()
+                while frontier or running:
+                    # two summoners per worker are in flight, so no worker idles while the parent expands the frontier
+                    while frontier and len(running) < 2 * self.workers and (max_summoners is None or submitted < max_summoners):
+                        running.add(pool.submit(_crawl_summoner, frontier.popleft(), self.number_of_games))
+                        submitted += 1
+                    if not running:
+                        break
+                    done, running = wait(running, timeout=self.report_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        crawled += 1
+                        try:
+                            account_id, co_players = future.result()
+                        except Exception as e:
+                            api.logging.error('error while crawling summoner')
+                            api.logging.error(str(e))
+                            continue
+                        if account_id is None:
+                            continue
+                        accounts.add(account_id)
+                        for co_account, co_name in co_players:
+                            if co_account in accounts or co_name.lower() in names:
+                                continue
+                            accounts.add(co_account)
+                            names.add(co_name.lower())
+                            frontier.append(co_name)
+                    if monotonic() >= next_report:
+                        self.report(self.__stats(db, start, crawled, matches_before, len(frontier), len(running)))
+                        next_report = monotonic() + self.report_interval
+
+            stats = self.__stats(db, start, crawled, matches_before, len(frontier), 0)
+            self.report(stats)
+            return stats
+
+
+class PlatformScheduler:
+    # updates the summoners of several platforms at the same time. riot limits every platform on its own, so
+    # each platform runs in its own thread with its own LeagueDB, RateLimiter and writer and the budgets add up.
+    # the game_id keys are namespaced by platform, so the platforms load into the same tables without collisions.
+    def __init__(self, con: str, api_key: str, rate_limits: str='20:1,100:120', base_urls: Dict[str, str]=None, metrics: Metrics=None, **options) -> None:
+        self.con = con
+        self.api_key = api_key
+        self.rate_limits = rate_limits
+        # base url per platform, e.g. mock servers, the riot host of the platform otherwise
+        self.base_urls = base_urls or {}
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.options = options
+
+    def __update_platform(self, platform: str, summoner_names: List[str], number_of_games: int, batch_size: int) -> Dict[str, float]:
+        db = database.LeagueDB(self.con, self.api_key, platform=platform, rate_limits=self.rate_limits, base_url=self.base_urls.get(platform),
+                               metrics=self.metrics, **self.options)
+        start = monotonic()
+        for summoner_name in summoner_names:
+            db.update_summoner(summoner_name, number_of_games=number_of_games, batch_size=batch_size)
+        return {'summoners': len(summoner_names), 'seconds': round(monotonic() - start, 1), 'requests': db.api.stats['requests']}
+
+    def run(self, summoners: Dict[str, List[str]], number_of_games: int=100, batch_size: int=20) -> Dict[str, Dict[str, float]]:
+        # summoners maps platform ids to summoner names, returns the stats per platform
+        with ThreadPoolExecutor(max(1, len(summoners))) as pool:
+            futures = {platform.upper(): pool.submit(self.__update_platform, platform.upper(), names, number_of_games, batch_size) for platform, names in summoners.items()}
+            return {platform: future.result() for platform, future in futures.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='crawl the ladder starting at the challenger leaderboards')
+    parser.add_argument('con', help='sqlalchemy url of the database')
+    parser.add_argument('api_key')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate-limits', default='20:1,100:120', help='application rate limits of the api key shared by all workers')
+    parser.add_argument('--games', type=int, default=100, help='matches listed per summoner on its first sync')
+    parser.add_argument('--max-summoners', type=int)
+    parser.add_argument('--report-interval', type=float, default=30)
+    args = parser.parse_args()
+    crawler = LadderCrawler(args.con, args.api_key, workers=args.workers, rate_limits=args.rate_limits, number_of_games=args.games,
+                            report_interval=args.report_interval, report=lambda stats: print(', '.join('{0}: {1}'.format(key, value) for key, value in stats.items())))
+    crawler.run(max_summoners=args.max_summoners)
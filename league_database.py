@@ -1,14 +1,28 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import pandas as pd
 from sqlalchemy.orm.exc import NoResultFound
+import asyncio
 import league_api as api
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy import create_engine
+import league_async as async_api
+from league_cache import ResponseCache, TTLCache
+from league_metrics import Metrics
+from contextlib import ExitStack
+import hashlib
+from sqlalchemy import create_engine, insert, update, select, delete, inspect, func, case, or_, and_, bindparam, text, Table, MetaData, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, SmallInteger, BigInteger, String, DateTime, Boolean, ForeignKey, Enum as SqlEnum
+from sqlalchemy.dialects import postgresql, sqlite, mysql
 from sqlalchemy.orm import sessionmaker, relationship
 from psycopg2.extensions import register_adapter, AsIs
+import numpy as np
 from numpy import int64
+from typing import Dict, List, Tuple
+from enum import Enum
+from time import sleep
+import os
+import socket
+import re
+from io import StringIO
 
 
 # conversation numpy.int64 to int
@@ -31,14 +45,14 @@ class Summoner(Base):
 class Match(Base):
     __tablename__ = 'matches'
 
-    game_id = Column(String, primary_key=True)
+    game_id = Column(BigInteger, primary_key=True)
 
     platform_id = Column(String)
     game_creation = Column(DateTime)
     game_duration = Column(Integer)
-    queue_id = Column(String)
-    map_id = Column(String)
-    season_id = Column(String)
+    queue_id = Column(SmallInteger)
+    map_id = Column(SmallInteger)
+    season_id = Column(SmallInteger)
     game_version = Column(String)
     game_mode = Column(String)
     game_type = Column(String)
@@ -46,8 +60,8 @@ class Match(Base):
 class Team(Base):
     __tablename__ = 'teams'
 
-    game_id = Column(String, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
-    team_id = Column(String, primary_key=True)
+    game_id = Column(BigInteger, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
+    team_id = Column(SmallInteger, primary_key=True)
 
     win = Column(String)
     first_blood = Column(Boolean)
@@ -67,16 +81,16 @@ class Team(Base):
 class Ban(Base):
     __tablename__ = 'bans'
 
-    game_id = Column(String, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
-    team_id = Column(String, primary_key=True)
-    pick_turn = Column(Integer, primary_key=True)
+    game_id = Column(BigInteger, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
+    team_id = Column(SmallInteger, primary_key=True)
+    pick_turn = Column(SmallInteger, primary_key=True)
     champion_id = Column(Integer, primary_key=True)
 
 class Participant(Base):
     __tablename__ = 'participants'
 
-    game_id = Column(String, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
-    participant_id = Column(String, primary_key=True)
+    game_id = Column(BigInteger, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
+    participant_id = Column(SmallInteger, primary_key=True)
 
     platform_id = Column(String)
     account_id = Column(String)
@@ -90,9 +104,9 @@ class Participant(Base):
 class Stats(Base):
     __tablename__ = 'stats'
 
-    game_id = Column(String, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
-    team_id = Column(String, primary_key=True)
-    participant_id = Column(String, primary_key=True)
+    game_id = Column(BigInteger, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
+    team_id = Column(SmallInteger, primary_key=True)
+    participant_id = Column(SmallInteger, primary_key=True)
     
     champion_id = Column(Integer)
     spell1_id = Column(Integer)
@@ -200,69 +214,717 @@ class Stats(Base):
     stat_perk0 = Column(Integer)
     stat_perk1 = Column(Integer)
     stat_perk2 = Column(Integer)
-    role = Column(String)
-    lane = Column(String)
+    role = Column(SqlEnum(api.Role, name='role'))
+    lane = Column(SqlEnum(api.Lane, name='lane'))
 
 class TimelineParticipant(Base):
     __tablename__ = 'timeline_participants'
+    __table_args__ = (Index('ix_timeline_participants_timestamp_participant_id', 'timestamp', 'participant_id'),)
 
-    game_id = Column(String, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
+    game_id = Column(BigInteger, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
     timestamp = Column(Integer, primary_key=True)
-    participant_id = Column(String, primary_key=True)
+    participant_id = Column(SmallInteger, primary_key=True)
 
     current_gold = Column(Integer)
     total_gold = Column(Integer)
-    level = Column(Integer)
+    level = Column(SmallInteger)
     xp = Column(Integer)
     minions_killed = Column(Integer)
     jungle_minions_killed = Column(Integer)
     dominion_score = Column(Integer)
     team_score = Column(Integer)
-    position_x = Column(Integer)
-    position_y = Column(Integer)
+    position_x = Column(SmallInteger)
+    position_y = Column(SmallInteger)
+    # copied from the match, they are the partition keys of a partitioned layout
+    game_creation = Column(DateTime)
+    patch = Column(String)
 
 class TimelineEvents(Base):
     __tablename__ = 'timeline_events'
+    __table_args__ = (Index('ix_timeline_events_type_item_id', 'type', 'item_id'),)
 
-    game_id = Column(String, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
+    game_id = Column(BigInteger, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
     timestamp = Column(Integer, primary_key=True)
-    participant_id = Column(String, primary_key=True)
-    type = Column(String, primary_key=True)
-    sequence = Column(Integer, primary_key=True)
-
-    skill_slot = Column(String)
-    level_up_type = Column(String)
-    item_id = Column(String)
-    ward_type = Column(String)
-    creator_id = Column(String)
-    killer_id = Column(String)
-    victim_id = Column(String)
+    participant_id = Column(SmallInteger, primary_key=True)
+    type = Column(SqlEnum(api.EventType, name='event_type'), primary_key=True)
+    sequence = Column(SmallInteger, primary_key=True)
+
+    skill_slot = Column(SmallInteger)
+    level_up_type = Column(SqlEnum(api.LevelUpType, name='level_up_type'))
+    item_id = Column(Integer)
+    ward_type = Column(SqlEnum(api.WardType, name='ward_type'))
+    creator_id = Column(SmallInteger)
+    killer_id = Column(SmallInteger)
+    victim_id = Column(SmallInteger)
     assisting_participant_ids = Column(String)
-    position_x = Column(String)
-    position_y = Column(String)
-    monster_type = Column(String)
-    after_id = Column(String)
-    before_id = Column(String)
-    team_id = Column(String)
-    building_type = Column(String)
-    lane_type = Column(String)
-    tower_type = Column(String)
-    monster_sub_type = Column(String)
+    position_x = Column(SmallInteger)
+    position_y = Column(SmallInteger)
+    monster_type = Column(SqlEnum(api.MonsterType, name='monster_type'))
+    after_id = Column(Integer)
+    before_id = Column(Integer)
+    team_id = Column(SmallInteger)
+    building_type = Column(SqlEnum(api.BuildingType, name='building_type'))
+    lane_type = Column(SqlEnum(api.LaneType, name='lane_type'))
+    tower_type = Column(SqlEnum(api.TowerType, name='tower_type'))
+    monster_sub_type = Column(SqlEnum(api.MonsterSubType, name='monster_sub_type'))
+    game_creation = Column(DateTime)
+    patch = Column(String)
+
+class JobState(Enum):
+    PENDING = 'pending'
+    IN_PROGRESS = 'in_progress'
+    DONE = 'done'
+    FAILED = 'failed'
+
+class IngestionJob(Base):
+    __tablename__ = 'ingestion_jobs'
+
+    game_id = Column(String, primary_key=True)
+
+    state = Column(String, index=True)
+    attempts = Column(Integer)
+    next_retry = Column(DateTime)
+    locked_until = Column(DateTime)
+    worker = Column(String)
+    error = Column(String)
+    updated = Column(DateTime)
+
+class StaticDataVersion(Base):
+    __tablename__ = 'static_data_versions'
+
+    name = Column(String, primary_key=True)
+
+    digest = Column(String)
+    updated = Column(DateTime)
+
+class SyncState(Base):
+    __tablename__ = 'sync_state'
+
+    account_id = Column(String, primary_key=True)
+
+    last_timestamp = Column(BigInteger)
+    last_game_id = Column(String)
+    updated = Column(DateTime)
+
+class ChampionAggregate(Base):
+    __tablename__ = 'champion_aggregates'
+
+    champion_id = Column(Integer, primary_key=True)
+    game_version = Column(String, primary_key=True)
+    queue_id = Column(SmallInteger, primary_key=True)
+    role = Column(SqlEnum(api.Role, name='role'), primary_key=True)
+    lane = Column(SqlEnum(api.Lane, name='lane'), primary_key=True)
+
+    games = Column(Integer)
+    wins = Column(Integer)
+    kills = Column(BigInteger)
+    deaths = Column(BigInteger)
+    assists = Column(BigInteger)
+    gold_earned = Column(BigInteger)
+    game_duration = Column(BigInteger)
+
+class BanAggregate(Base):
+    __tablename__ = 'ban_aggregates'
+
+    champion_id = Column(Integer, primary_key=True)
+    game_version = Column(String, primary_key=True)
+    queue_id = Column(SmallInteger, primary_key=True)
+
+    bans = Column(Integer)
+
+class MatchFeature(Base):
+    __tablename__ = 'match_features'
+
+    game_id = Column(BigInteger, ForeignKey('matches.game_id', ondelete='CASCADE'), primary_key=True)
+    participant_id = Column(SmallInteger, primary_key=True)
+
+    team_id = Column(SmallInteger)
+    champion_id = Column(Integer)
+    role = Column(SqlEnum(api.Role, name='role'))
+    lane = Column(SqlEnum(api.Lane, name='lane'))
+    # participant_id of the lane opponent, null when the lane and role of the game do not pair up
+    opponent_id = Column(SmallInteger)
+
+    gold_10 = Column(Integer)
+    xp_10 = Column(Integer)
+    cs_10 = Column(SmallInteger)
+    gold_diff_10 = Column(Integer)
+    xp_diff_10 = Column(Integer)
+    cs_diff_10 = Column(SmallInteger)
+    gold_15 = Column(Integer)
+    xp_15 = Column(Integer)
+    cs_15 = Column(SmallInteger)
+    gold_diff_15 = Column(Integer)
+    xp_diff_15 = Column(Integer)
+    cs_diff_15 = Column(SmallInteger)
+    gold_20 = Column(Integer)
+    xp_20 = Column(Integer)
+    cs_20 = Column(SmallInteger)
+    gold_diff_20 = Column(Integer)
+    xp_diff_20 = Column(Integer)
+    cs_diff_20 = Column(SmallInteger)
+
+# sums and counts of the aggregate tables, win rate is wins / games, kda (kills + assists) / deaths,
+# gold per minute gold_earned / game_duration * 60 and the ban rate bans / (sum of games / 10)
+CHAMPION_AGGREGATE_KEYS = ['champion_id', 'game_version', 'queue_id', 'role', 'lane']
+CHAMPION_AGGREGATE_SUMS = ['wins', 'kills', 'deaths', 'assists', 'gold_earned', 'game_duration']
+BAN_AGGREGATE_KEYS = ['champion_id', 'game_version', 'queue_id']
+
+def _aggregate(frames: Dict[str, pd.DataFrame], game_ids: set) -> Dict[str, pd.DataFrame]:
+    # sums and counts of the matches in game_ids, frames are the prepared frames of a flush
+    if 'matches' not in frames or not game_ids:
+        return {}
+    games = frames['matches']
+    games = games[games.game_id.isin(game_ids)][['game_id', 'game_version', 'queue_id', 'game_duration']]
+    aggregates = {}
+    if 'stats' in frames:
+        stats = frames['stats'].merge(games, on='game_id')
+        stats['wins'] = stats.win.astype(bool).astype(int)
+        grouped = stats.groupby(CHAMPION_AGGREGATE_KEYS, observed=True)
+        champions = grouped[CHAMPION_AGGREGATE_SUMS].sum()
+        champions['games'] = grouped.size()
+        aggregates['champion_aggregates'] = champions.reset_index()
+    if 'bans' in frames:
+        bans = frames['bans'].merge(games, on='game_id')
+        aggregates['ban_aggregates'] = bans.groupby(BAN_AGGREGATE_KEYS).size().rename('bans').reset_index()
+    return aggregates
+
+def _increment(connection, table: Table, frame: pd.DataFrame) -> None:
+    # adds the sums and counts of frame to the existing rows of table
+    if frame.empty:
+        return
+    keys = [column.name for column in table.primary_key.columns]
+    values = [column for column in frame.columns if column not in keys]
+    if connection.dialect.name in ('postgresql', 'sqlite'):
+        statement = (postgresql if connection.dialect.name == 'postgresql' else sqlite).insert(table)
+        statement = statement.on_conflict_do_update(index_elements=keys, set_={column: table.c[column] + statement.excluded[column] for column in values})
+    elif connection.dialect.name == 'mysql':
+        statement = mysql.insert(table)
+        statement = statement.on_duplicate_key_update({column: table.c[column] + statement.inserted[column] for column in values})
+    else:
+        statement = insert(table)
+    records = frame.astype(object).where(frame.notna(), None).to_dict('records')
+    connection.execute(statement, records)
+
+def rebuild_aggregates(connection) -> None:
+    # recomputes the aggregate tables from all matches
+    connection.execute(delete(ChampionAggregate))
+    connection.execute(delete(BanAggregate))
+    keys = [Stats.champion_id, Match.game_version, Match.queue_id, Stats.role, Stats.lane]
+    champions = select(*keys, func.count(), func.sum(case((Stats.win, 1), else_=0)), func.sum(Stats.kills), func.sum(Stats.deaths),
+                       func.sum(Stats.assists), func.sum(Stats.gold_earned), func.sum(Match.game_duration)) \
+        .join(Match, Match.game_id == Stats.game_id).where(Stats.role.isnot(None), Stats.lane.isnot(None)).group_by(*keys)
+    connection.execute(insert(ChampionAggregate).from_select(CHAMPION_AGGREGATE_KEYS + ['games'] + CHAMPION_AGGREGATE_SUMS, champions))
+    keys = [Ban.champion_id, Match.game_version, Match.queue_id]
+    bans = select(*keys, func.count()).join(Match, Match.game_id == Ban.game_id).group_by(*keys)
+    connection.execute(insert(BanAggregate).from_select(BAN_AGGREGATE_KEYS + ['bans'], bans))
+
+FEATURE_MINUTES = (10, 15, 20)
+FEATURE_NAMES = ('gold', 'xp', 'cs')
+
+def match_features(frames: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    # gold, xp and cs of every participant at FEATURE_MINUTES and the differences to its lane opponent.
+    # the values are scattered into a (games, participants, minutes, features) array, the opponent is the
+    # participant of the other team with the same lane and role and is paired by indexing that array.
+    timelines = frames.get('timeline_participants')
+    stats = frames.get('stats')
+    if timelines is None or stats is None or timelines.empty or stats.empty:
+        return pd.DataFrame()
+    timelines = timelines.reset_index()
+    stats = stats.reset_index()
+    games = np.unique(stats.game_id.to_numpy(dtype='int64'))
+    minutes = np.array(FEATURE_MINUTES)
+
+    # the frame of minute m is the first frame with a timestamp of m * 60000 or slightly above. a game that ends
+    # within minute m has a second frame in it, at the end of the game, which is skipped
+    game_ids = timelines.game_id.to_numpy(dtype='int64')
+    timestamps = timelines.timestamp.to_numpy(dtype='int64')
+    game = np.minimum(np.searchsorted(games, game_ids), len(games) - 1)
+    minute = np.minimum(np.searchsorted(minutes, timestamps // 60000), len(minutes) - 1)
+    participant = timelines.participant_id.to_numpy(dtype='int64') - 1
+    valid = (games[game] == game_ids) & (minutes[minute] == timestamps // 60000) & (participant >= 0) & (participant < 10)
+    rows = np.flatnonzero(valid)
+    rows = rows[np.argsort(timestamps[rows], kind='stable')]
+    _, first = np.unique((game[rows] * 10 + participant[rows]) * len(minutes) + minute[rows], return_index=True)
+    rows = rows[first]
+    values = np.full((len(games), 10, len(minutes), len(FEATURE_NAMES)), np.nan)
+    values[game[rows], participant[rows], minute[rows]] = np.column_stack([
+        timelines.total_gold.to_numpy(dtype='float64'), timelines.xp.to_numpy(dtype='float64'),
+        timelines.minions_killed.to_numpy(dtype='float64') + timelines.jungle_minions_killed.fillna(0).to_numpy(dtype='float64')])[rows]
+
+    game = np.searchsorted(games, stats.game_id.to_numpy(dtype='int64'))
+    participant = stats.participant_id.to_numpy(dtype='int64') - 1
+    present = (participant >= 0) & (participant < 10)
+    stats, game, participant = stats[present], game[present], participant[present]
+    lane = stats.lane.astype(object)
+    position, _ = pd.factorize(lane.astype(str) + '/' + stats.role.astype(object).astype(str))
+    position[(lane.isna() | (lane == api.Lane.NONE.value) | stats.role.isna()).to_numpy()] = -1
+    positions = np.full((len(games), 10), -1)
+    positions[game, participant] = position
+    teams = np.full((len(games), 10), -1)
+    teams[game, participant] = stats.team_id.to_numpy(dtype='int64')
+
+    # the opponent is only taken when exactly one participant of the other team has the same position
+    same = (positions[:, :, None] == positions[:, None, :]) & (positions[:, :, None] >= 0) & (teams[:, :, None] != teams[:, None, :])
+    paired = same.sum(axis=2) == 1
+    opponent = same.argmax(axis=2)
+    opponents = values[np.arange(len(games))[:, None], opponent]
+    diffs = np.where(paired[:, :, None, None], values - opponents, np.nan)
+
+    features = pd.DataFrame({'game_id': games[game], 'participant_id': participant + 1, 'team_id': stats.team_id.to_numpy(),
+                             'champion_id': stats.champion_id.to_numpy(), 'role': stats.role.to_numpy(), 'lane': stats.lane.to_numpy(),
+                             'opponent_id': np.where(paired[game, participant], opponent[game, participant] + 1, np.nan)})
+    for index, at in enumerate(FEATURE_MINUTES):
+        for feature, name in enumerate(FEATURE_NAMES):
+            features['{0}_{1}'.format(name, at)] = values[game, participant, index, feature]
+            features['{0}_diff_{1}'.format(name, at)] = diffs[game, participant, index, feature]
+    return features.set_index(['game_id', 'participant_id'])
+
+def match_tables() -> List[Table]:
+    # matches and the tables keyed by its game_id, parents first
+    return [table for table in Base.metadata.sorted_tables if 'game_id' in table.c and isinstance(table.c.game_id.type, BigInteger)]
+
+def _insert_ignore(connection, table: Table):
+    # insert statement that skips rows whose primary key already exists
+    if connection.dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    elif connection.dialect.name == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    elif connection.dialect.name == 'mysql':
+        return insert(table).prefix_with('IGNORE')
+    return insert(table)
+
+def _upsert(connection, table: Table, columns: List[str]):
+    # insert statement that overwrites the given columns of rows whose primary key already exists
+    keys = [column.name for column in table.primary_key.columns]
+    values = [column for column in columns if column not in keys]
+    if not values:
+        return _insert_ignore(connection, table)
+    if connection.dialect.name in ('postgresql', 'sqlite'):
+        statement = (postgresql if connection.dialect.name == 'postgresql' else sqlite).insert(table)
+        return statement.on_conflict_do_update(index_elements=keys, set_={column: statement.excluded[column] for column in values})
+    elif connection.dialect.name == 'mysql':
+        statement = mysql.insert(table)
+        return statement.on_duplicate_key_update({column: statement.inserted[column] for column in values})
+    return insert(table)
+
+TIMELINE_TABLES = ('timeline_participants', 'timeline_events')
+
+def denormalize_timelines(frames: Dict[str, pd.DataFrame]) -> None:
+    # copies game_creation and the patch of each match to the rows of its timeline
+    games = frames['matches']
+    patches = games.game_version.str.split('.').str[:2].str.join('.')
+    for name in TIMELINE_TABLES:
+        if name in frames and not frames[name].empty:
+            game_ids = frames[name].index.get_level_values('game_id')
+            frames[name] = frames[name].assign(game_creation=game_ids.map(games.game_creation), patch=game_ids.map(patches))
+
+def denormalize_timeline_tables(connection) -> None:
+    # denormalize_timelines for the rows in the database that have no game_creation and patch, e.g. copied by migrate_schema
+    patches = {}
+    for version in connection.execute(select(Match.game_version).distinct()).scalars():
+        if version:
+            patches.setdefault('.'.join(version.split('.')[:2]), []).append(version)
+    for name in TIMELINE_TABLES:
+        table = Base.metadata.tables[name]
+        connection.execute(update(table).where(table.c.game_creation.is_(None)).values(
+            game_creation=select(Match.game_creation).where(Match.game_id == table.c.game_id).scalar_subquery()))
+        for patch, versions in patches.items():
+            games = select(Match.game_id).where(Match.game_version.in_(versions))
+            connection.execute(update(table).where(table.c.patch.is_(None), table.c.game_id.in_(games)).values(patch=patch))
+
+def _is_partitioned(connection, name: str) -> bool:
+    # whether a postgres table exists as a partitioned table
+    return connection.execute(text('SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name))'), {'name': name}).scalar()
+
+class TimelinePartitions:
+    # postgres declarative partitioning of the timeline tables by month of game_creation or by patch.
+    # partitions are created right before rows are written to them, so there is no default partition
+    # that would have to be split later.
+    METHODS = {'month': ('RANGE', 'game_creation'), 'patch': ('LIST', 'patch')}
+
+    def __init__(self, partition_by: str) -> None:
+        if partition_by not in self.METHODS:
+            raise ValueError('partition_by must be one of {0}'.format(', '.join(self.METHODS)))
+        self.partition_by = partition_by
+        self.method, self.column = self.METHODS[partition_by]
+
+    def metadata(self) -> MetaData:
+        # the partition key has to be part of the primary key of a partitioned table
+        metadata = MetaData()
+        Match.__table__.to_metadata(metadata)
+        for name in TIMELINE_TABLES:
+            table = Base.metadata.tables[name]
+            columns = [Column(column.name, column.type.copy(), *[ForeignKey(key.target_fullname, ondelete=key.ondelete) for key in column.foreign_keys],
+                              primary_key=column.primary_key or column.name == self.column) for column in table.columns]
+            partitioned = Table(name, metadata, *columns, postgresql_partition_by='{0} ({1})'.format(self.method, self.column))
+            for index in table.indexes:
+                Index(index.name, *[partitioned.c[column.name] for column in index.columns])
+        return metadata
+
+    def create(self, engine) -> None:
+        metadata = self.metadata()
+        metadata.create_all(engine, tables=[metadata.tables[name] for name in TIMELINE_TABLES])
+
+    def ensure(self, connection, name: str, frame: pd.DataFrame) -> None:
+        quote = connection.dialect.identifier_preparer.quote
+        for value in frame[self.column].dropna().unique():
+            partition, bounds = self.__partition(name, value)
+            connection.exec_driver_sql('CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1} {2}'.format(quote(partition), quote(name), bounds))
+
+    def __partition(self, name: str, value) -> Tuple[str, str]:
+        if self.partition_by == 'month':
+            month = pd.Timestamp(value).to_period('M')
+            return '{0}_y{1}m{2:02d}'.format(name, month.year, month.month), \
+                "FOR VALUES FROM ('{0}') TO ('{1}')".format(month.start_time.date(), (month + 1).start_time.date())
+        patch = str(value).replace("'", "''")
+        return '{0}_p{1}'.format(name, re.sub(r'\W', '_', patch)), "FOR VALUES IN ('{0}')".format(patch)
+
+class BulkWriter:
+    # buffers the frames of many matches and writes all tables in one transaction on one pooled
+    # connection per flush, so a failed flush leaves no match behind with only some of its tables.
+    # postgres (psycopg2) copies into a temporary staging table and inserts from there, other dialects
+    # use executemany. existing rows are skipped, or overwritten with upsert, so writes are idempotent.
+    def __init__(self, engine, batch_size: int=50000, upsert: bool=False, metadata: MetaData=None, partitions: TimelinePartitions=None,
+                 aggregate: bool=False, metrics: Metrics=None) -> None:
+        self.engine = engine
+        self.metrics = metrics if metrics is not None else Metrics()
+        # with aggregate the aggregate tables are incremented in the same transaction by the matches that are new to the database
+        self.aggregate = aggregate
+        self.partitions = partitions
+        # the partitioned timeline tables have the partition key in their primary key, it is part of the conflict target
+        self.partitioned = partitions.metadata() if partitions is not None else None
+        # per timeline table whether it is actually partitioned, tables created without partition_by stay plain
+        self.partitioned_tables = {}
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.metadata = metadata if metadata is not None else Base.metadata
+        self.buffer = {}
+        self.buffered_rows = 0
+        self.stats = {'flushes': 0, 'rows': 0, 'seconds': 0.0}
+
+    def add(self, frames: Dict[str, pd.DataFrame]) -> None:
+        for name, frame in frames.items():
+            if frame.empty:
+                continue
+            self.buffer.setdefault(name, []).append(frame)
+            self.buffered_rows += len(frame)
+        if self.buffered_rows >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> int:
+        if not self.buffer:
+            return 0
+        buffer, self.buffer, self.buffered_rows = self.buffer, {}, 0
+        start = api.monotonic()
+        rows = 0
+        with self.engine.begin() as connection:
+            frames = {}
+            new_games = set()
+            # sorted_tables orders matches before the tables referencing it
+            for table in self.metadata.sorted_tables:
+                if table.name in buffer:
+                    frame = self.__prepare(table, pd.concat(buffer[table.name]))
+                    if self.aggregate and table.name == 'matches':
+                        # matches that are rewritten were counted already
+                        existing = connection.execute(select(table.c.game_id).where(table.c.game_id.in_([int(game_id) for game_id in frame.game_id]))).scalars().all()
+                        new_games = set(frame.game_id) - set(existing)
+                    if self.__partitioned(connection, table.name):
+                        self.partitions.ensure(connection, table.name, frame)
+                    table_start = api.monotonic()
+                    written = self.__write(connection, self.__target(connection, table), frame)
+                    self.metrics.inc('pyleague_rows_written_total', written, table=table.name)
+                    self.metrics.inc('pyleague_table_write_seconds_total', api.monotonic() - table_start, table=table.name)
+                    rows += written
+                    frames[table.name] = frame
+            if self.aggregate:
+                for name, aggregate in _aggregate(frames, new_games).items():
+                    _increment(connection, self.metadata.tables[name], aggregate)
+        self.stats['flushes'] += 1
+        self.stats['rows'] += rows
+        self.stats['seconds'] += api.monotonic() - start
+        self.metrics.observe('pyleague_stage_seconds', api.monotonic() - start, stage='write')
+        return rows
+
+    def __partitioned(self, connection, name: str) -> bool:
+        if self.partitioned is None or name not in TIMELINE_TABLES or connection.dialect.name != 'postgresql':
+            return False
+        if name not in self.partitioned_tables:
+            self.partitioned_tables[name] = _is_partitioned(connection, name)
+            if not self.partitioned_tables[name]:
+                api.logging.warning('{0} is not partitioned, partition_by is ignored for it'.format(name))
+        return self.partitioned_tables[name]
+
+    def __target(self, connection, table: Table) -> Table:
+        if self.__partitioned(connection, table.name):
+            return self.partitioned.tables[table.name]
+        return table
+
+    def __prepare(self, table: Table, frame: pd.DataFrame) -> pd.DataFrame:
+        frame = frame.reset_index()
+        frame = frame[[column.name for column in table.columns if column.name in frame.columns]]
+        frame = frame.drop_duplicates(subset=[column.name for column in table.primary_key.columns if column.name in frame.columns])
+        for column in table.columns:
+            # integer columns of the former layout arrive as strings
+            if isinstance(column.type, Integer) and column.name in frame and frame[column.name].dtype.kind == 'O':
+                frame[column.name] = pd.to_numeric(frame[column.name])
+            # integer columns containing nulls arrive as floats
+            if isinstance(column.type, Integer) and column.name in frame and frame[column.name].dtype.kind == 'f':
+                frame[column.name] = frame[column.name].round().astype('Int64')
+            # sqlite returns datetimes as text and booleans as integers
+            if isinstance(column.type, DateTime) and column.name in frame and frame[column.name].dtype.kind == 'O':
+                frame[column.name] = pd.to_datetime(frame[column.name])
+            if isinstance(column.type, Boolean) and column.name in frame and frame[column.name].dtype.kind != 'b':
+                frame[column.name] = frame[column.name].map(lambda value: value in (True, 1, '1', 'true', 'True'), na_action='ignore')
+        return frame
+
+    def __write(self, connection, table: Table, frame: pd.DataFrame) -> int:
+        if connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2':
+            return self.__copy(connection, table, frame)
+        records = frame.astype(object).where(frame.notna(), None).to_dict('records')
+        statement = _upsert(connection, table, list(frame.columns)) if self.upsert else _insert_ignore(connection, table)
+        connection.execute(statement, records)
+        return len(records)
+
+    def __copy(self, connection, table: Table, frame: pd.DataFrame) -> int:
+        quote = connection.dialect.identifier_preparer.quote
+        columns = ', '.join(quote(column) for column in frame.columns)
+        staging = quote('staging_' + table.name)
+        connection.exec_driver_sql('CREATE TEMPORARY TABLE {0} (LIKE {1} INCLUDING DEFAULTS) ON COMMIT DROP'.format(staging, quote(table.name)))
+        data = StringIO()
+        frame.to_csv(data, index=False, header=False)
+        data.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert('COPY {0} ({1}) FROM STDIN WITH (FORMAT csv)'.format(staging, columns), data)
+        keys = [column.name for column in table.primary_key.columns]
+        values = [column for column in frame.columns if column not in keys]
+        conflict = 'DO NOTHING'
+        if self.upsert and values:
+            conflict = '({0}) DO UPDATE SET {1}'.format(', '.join(quote(column) for column in keys), ', '.join('{0} = EXCLUDED.{0}'.format(quote(column)) for column in values))
+        connection.exec_driver_sql('INSERT INTO {0} ({1}) SELECT {1} FROM {2} ON CONFLICT {3}'.format(quote(table.name), columns, staging, conflict))
+        return len(frame)
+
 
 class LeagueDB:
-    def __init__(self, con: str, api_key: str):
+    def __init__(self, con: str, api_key: str, write_batch_size: int=50000, cache_dir: str=None, cache_size: int=10 * 1024 ** 3, offline: bool=False,
+                 memo_dir: str=None, memo_ttls: Dict[str, float]=None, max_attempts: int=5, retry_delay: float=60, job_lease: float=600,
+                 limiter: api.RateLimiter=None, partition_by: str=None, metrics: Metrics=None, base_url: str=None, platform: str='EUW1',
+                 rate_limits: str='20:1,100:120'):
         self.engine = create_engine(con)
         self.Session = sessionmaker(bind=self.engine)
-        self.api = api.RiotApi(api_key)
+        cache = ResponseCache(cache_dir, max_bytes=cache_size) if cache_dir is not None else None
+        # one metrics registry for the api and the writer, see get_metrics
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.api = api.RiotApi(api_key, rate_limits=rate_limits, base_url=base_url, limiter=limiter, cache=cache, offline=offline,
+                               memo=self._memo(memo_ttls, memo_dir, platform), metrics=self.metrics, platform=platform)
+        # clients of the other platforms are created on first use, each with its own rate budget and summoner memo.
+        # the response cache is shared, its keys are the namespaced game_ids. a base_url (e.g. a mock server) is used for all platforms
+        self.apis = {self.api.platform: self.api}
+        self.base_url = base_url
+        self.rate_limits = rate_limits
+        self.memo_ttls = memo_ttls
+        self.memo_dir = memo_dir
+        # matches are upserted, a match that is written again (reload, retry of a lost job) replaces its rows
+        # the timeline tables are partitioned by 'month' or 'patch' on postgres, other databases ignore partition_by
+        self.partitions = TimelinePartitions(partition_by) if partition_by is not None else None
+        self.writer = BulkWriter(self.engine, batch_size=write_batch_size, upsert=True, partitions=self.partitions, aggregate=True, metrics=self.metrics)
+        self.profilers = []
+
+        # ingestion queue: failed matches are retried after retry_delay * 2 ** (attempts - 1) seconds,
+        # in_progress jobs of a worker that died are claimable again after job_lease seconds
+        self.worker = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.job_lease = job_lease
+
+    @staticmethod
+    def _memo(memo_ttls: Dict[str, float], memo_dir: str, platform: str) -> TTLCache:
+        # summoner names are only unique per platform, every platform memoizes into its own directory
+        return TTLCache(memo_ttls, directory=os.path.join(memo_dir, platform.upper()) if memo_dir is not None else None)
+
+    def get_api(self, platform: str=None) -> api.RiotApi:
+        # the client of a platform, the one of the constructor without platform
+        if platform is None:
+            return self.api
+        platform = platform.upper()
+        if platform not in self.apis:
+            self.apis[platform] = api.RiotApi(self.api.key, rate_limits=self.rate_limits, base_url=self.base_url, cache=self.api.cache, offline=self.api.offline,
+                                              memo=self._memo(self.memo_ttls, self.memo_dir, platform), metrics=self.metrics, static_url=self.api.static_url, ddragon_url=self.api.ddragon_url, platform=platform)
+        return self.apis[platform]
+
+    def get_metrics(self, format: str='prometheus') -> str:
+        return self.metrics.to_json() if format == 'json' else self.metrics.to_prometheus()
+
+    def add_profiler(self, hook) -> None:
+        # hook(run, summoner_name) returns a context manager wrapped around every update_summoner run,
+        # e.g. league_metrics.cprofile_hook(directory)
+        self.profilers.append(hook)
+
+    def _profiled(self, run: str, summoner_name: str) -> ExitStack:
+        stack = ExitStack()
+        for hook in self.profilers:
+            stack.enter_context(hook(run, summoner_name))
+        stack.enter_context(self.metrics.time('pyleague_run_seconds', run=run))
+        return stack
 
     def create_db_layout(self) -> None:
+        if self.partitions is not None and self.engine.dialect.name == 'postgresql':
+            Base.metadata.create_all(self.engine, tables=[table for table in Base.metadata.sorted_tables if table.name not in TIMELINE_TABLES])
+            self.partitions.create(self.engine)
+            with self.engine.connect() as connection:
+                for name in TIMELINE_TABLES:
+                    if not _is_partitioned(connection, name):
+                        # existing tables are not converted, the writer keeps writing them as plain tables
+                        api.logging.warning('{0} exists and is not partitioned, recreate it to partition it by {1}'.format(name, self.partitions.partition_by))
+        elif self.partitions is not None:
+            api.logging.warning('{0} does not support partitioned tables, timelines are not partitioned'.format(self.engine.dialect.name))
         Base.metadata.create_all(self.engine)
 
-    def update_summoner(self, summoner_name: str, number_of_games: int=100, champion_id: int=-1, season_id: str=-1, patch: str=-1, begin_time: datetime=None, queue_id: int=-1) -> None:
+    def migrate_schema(self, chunk_size: int=100000, platform: str=None) -> bool:
+        # moves the match tables of the former layout with string keys to the compact layout. the old
+        # tables are renamed to <name>_legacy, recreated and copied chunk by chunk through a bulk writer
+        # that converts the strings to the integer and enum columns, then the old tables are dropped.
+        # the copy skips rows that exist already, so an interrupted migration is resumed from the _legacy
+        # tables by calling it again. they are only dropped, all together, once every table is copied.
+        # the copied game ids are riot game ids, with platform they are namespaced afterwards, see rekey_games.
+        inspector = inspect(self.engine)
+        quote = self.engine.dialect.identifier_preparer.quote
+        tables = [table for table in match_tables() if inspector.has_table(table.name + '_legacy')]
+        if tables:
+            api.logging.info('resuming the migration of {0}'.format(', '.join(table.name for table in tables)))
+        else:
+            if not inspector.has_table(Match.__tablename__):
+                return False
+            game_id = next(column for column in inspector.get_columns(Match.__tablename__) if column['name'] == 'game_id')
+            if not isinstance(game_id['type'], String):
+                api.logging.info('schema is compact already')
+                return False
+            tables = [table for table in match_tables() if inspector.has_table(table.name)]
+            primary_keys = {table.name: inspector.get_pk_constraint(table.name).get('name') for table in tables}
+            with self.engine.begin() as connection:
+                for table in tables:
+                    connection.exec_driver_sql('ALTER TABLE {0} RENAME TO {1}'.format(quote(table.name), quote(table.name + '_legacy')))
+                    primary_key = primary_keys[table.name]
+                    if connection.dialect.name == 'postgresql' and primary_key:
+                        # the primary key index keeps its name and would collide with the one of the new table
+                        connection.exec_driver_sql('ALTER TABLE {0} RENAME CONSTRAINT {1} TO {2}'.format(quote(table.name + '_legacy'), quote(primary_key), quote(primary_key + '_legacy')))
+        Base.metadata.create_all(self.engine)
+        writer = BulkWriter(self.engine, batch_size=chunk_size)
+        for table in tables:
+            for chunk in pd.read_sql(sql='SELECT * FROM {0}'.format(quote(table.name + '_legacy')), con=self.engine, chunksize=chunk_size):
+                writer.add({table.name: chunk})
+                writer.flush()
+            api.logging.info('migrated {0}'.format(table.name))
+        with self.engine.begin() as connection:
+            for table in reversed(tables):
+                connection.exec_driver_sql('DROP TABLE {0}'.format(quote(table.name + '_legacy')))
+            denormalize_timeline_tables(connection)
+            rebuild_aggregates(connection)
+        if platform is not None:
+            self.rekey_games(platform)
+        self.backfill_match_features(chunk_size=max(1, chunk_size // 100))
+        return True
+
+    def rekey_games(self, platform: str, chunk_size: int=1000) -> int:
+        # namespaces the riot game ids of a database written before the game_id keys held the platform, e.g. by
+        # a single region deployment, see api.namespace_game_id. matches are re-keyed by their platform_id,
+        # ingestion jobs, sync states and cached payloads, which have no platform, by the platform of the
+        # database. EUW1 keys are riot game ids, so a EUW1 database keeps its keys. returns the re-keyed matches.
+        platform = platform.upper()
+        if platform not in api.PLATFORMS:
+            raise ValueError('platform must be one of {0}'.format(', '.join(api.PLATFORMS)))
+        with self.engine.connect() as connection:
+            games = connection.execute(select(Match.game_id, Match.platform_id).where(Match.game_id < api.GAME_ID_STRIDE)).all()
+        keys = {game_id: api.namespace_game_id(platform_id or platform, game_id) for game_id, platform_id in games}
+        keys = {game_id: key for game_id, key in keys.items() if game_id != key}
+        children = [table for table in match_tables() if table.name != Match.__tablename__ and inspect(self.engine).has_table(table.name)]
+        values = [column.name for column in Match.__table__.columns if column.name != 'game_id']
+        for offset in sorted({key - game_id for game_id, key in keys.items()}):
+            game_ids = [game_id for game_id, key in keys.items() if key - game_id == offset]
+            for start in range(0, len(game_ids), chunk_size):
+                chunk = game_ids[start:start + chunk_size]
+                # matches are copied to the new keys, their rows moved and the old matches deleted, so the foreign keys always hold
+                with self.engine.begin() as connection:
+                    connection.execute(insert(Match).from_select(['game_id'] + values, select(Match.game_id + offset, *[Match.__table__.c[name] for name in values])
+                                                                 .where(Match.game_id.in_(chunk))))
+                    for table in children:
+                        connection.execute(update(table).where(table.c.game_id.in_(chunk)).values(game_id=table.c.game_id + offset))
+                    connection.execute(delete(Match).where(Match.game_id.in_(chunk)))
+                    # renamed before the commit, a failed rename leaves the matches with their old keys
+                    self._rename_cached({game_id: keys[game_id] for game_id in chunk})
+            api.logging.info('re-keyed {0} matches of {1}'.format(len(game_ids), api.PLATFORM_IDS[offset // api.GAME_ID_STRIDE]))
+
+        with self.engine.begin() as connection:
+            jobs = connection.execute(select(IngestionJob.game_id)).scalars().all()
+            jobs = {game_id: keys.get(int(game_id), api.namespace_game_id(platform, game_id)) for game_id in jobs if int(game_id) < api.GAME_ID_STRIDE}
+            jobs = [{'old_id': game_id, 'new_id': str(key)} for game_id, key in jobs.items() if int(game_id) != key]
+            if jobs:
+                # the payloads of loaded matches were renamed with their match
+                self._rename_cached({int(job['old_id']): int(job['new_id']) for job in jobs if int(job['old_id']) not in keys})
+                connection.execute(update(IngestionJob).where(IngestionJob.game_id == bindparam('old_id')).values(game_id=bindparam('new_id')), jobs)
+            states = connection.execute(select(SyncState.account_id, SyncState.last_game_id).where(SyncState.last_game_id.isnot(None))).all()
+            states = [{'account': account_id, 'new_id': str(keys.get(int(game_id), api.namespace_game_id(platform, game_id)))}
+                      for account_id, game_id in states if int(game_id) < api.GAME_ID_STRIDE]
+            if states:
+                connection.execute(update(SyncState).where(SyncState.account_id == bindparam('account')).values(last_game_id=bindparam('new_id')), states)
+        return len(keys)
+
+    def _rename_cached(self, keys: Dict[int, int]) -> None:
+        if self.api.cache is None:
+            return
+        for game_id, key in keys.items():
+            for endpoint in ('match', 'timeline'):
+                self.api.cache.rename(endpoint, game_id, key)
+
+    def rebuild_aggregates(self) -> None:
+        with self.engine.begin() as connection:
+            rebuild_aggregates(connection)
+
+    def backfill_match_features(self, chunk_size: int=1000) -> int:
+        # builds match_features of the matches loaded before it was computed at ingest, chunk by chunk
+        MatchFeature.__table__.create(self.engine, checkfirst=True)
+        missing = select(Match.game_id).where(~select(MatchFeature.game_id).where(MatchFeature.game_id == Match.game_id).exists())
+        with self.engine.connect() as connection:
+            game_ids = connection.execute(missing).scalars().all()
+        last = max(FEATURE_MINUTES) + 1
+        for start in range(0, len(game_ids), chunk_size):
+            chunk = game_ids[start:start + chunk_size]
+            stats = pd.read_sql(sql=select(Stats.game_id, Stats.team_id, Stats.participant_id, Stats.champion_id, Stats.role, Stats.lane)
+                                .where(Stats.game_id.in_(chunk)), con=self.engine)
+            # enum columns are read as enum members
+            for column in ('role', 'lane'):
+                stats[column] = stats[column].map(lambda member: member.value, na_action='ignore')
+            timelines = pd.read_sql(sql=select(TimelineParticipant.game_id, TimelineParticipant.timestamp, TimelineParticipant.participant_id,
+                                               TimelineParticipant.total_gold, TimelineParticipant.xp, TimelineParticipant.minions_killed,
+                                               TimelineParticipant.jungle_minions_killed)
+                                    .where(TimelineParticipant.game_id.in_(chunk), TimelineParticipant.timestamp >= min(FEATURE_MINUTES) * 60000,
+                                           TimelineParticipant.timestamp < last * 60000), con=self.engine)
+            self.writer.add({'match_features': match_features({'stats': stats, 'timeline_participants': timelines})})
+            self._flush()
+            api.logging.info('built match features of {0} of {1} matches'.format(min(start + chunk_size, len(game_ids)), len(game_ids)))
+        return len(game_ids)
+
+    def export_parquet(self, directory: str, chunk_size: int=1000) -> int:
+        # imported here, pyarrow is only needed for the parquet export
+        from league_parquet import ParquetStore
+        return ParquetStore(directory).export(self.engine, chunk_size=chunk_size)
+
+    def update_summoner(self, summoner_name: str, number_of_games: int=100, champion_id: int=-1, season_id: str=-1, patch: str=-1, begin_time: datetime=None, queue_id: int=-1, batch_size: int=20,
+                        platform: str=None) -> None:
+        with self._profiled('update_summoner', summoner_name):
+            self._update_summoner(summoner_name, number_of_games=number_of_games, champion_id=champion_id, begin_time=begin_time, queue_id=queue_id, batch_size=batch_size,
+                                  platform=platform)
+            self._retry_due_jobs(batch_size)
+
+    def _update_summoner(self, summoner_name: str, number_of_games: int=100, champion_id: int=-1, begin_time: datetime=None, queue_id: int=-1, batch_size: int=20,
+                         platform: str=None) -> None:
         api.logging.info('update summoner: {0}'.format(summoner_name))
+        riot = self.get_api(platform)
         session = self.Session()
+        # unfiltered syncs continue from the watermark of the account, filtered ones would leave gaps behind it
+        incremental = begin_time is None and champion_id == -1 and queue_id == -1
         try:
-            df_summoner = self.api.get_summoner_by_name(summoner_name)
+            df_summoner = riot.get_summoner_by_name(summoner_name)
             if df_summoner.empty:
                 api.logging.info('summoner with name {0} not found'.format(summoner_name))
                 return
@@ -272,37 +934,23 @@ class LeagueDB:
             session.commit()
 
             try:
-                matches = self.api.get_match_list(summoner.account_id, champion_id=champion_id, end_index=number_of_games, begin_time=begin_time, queue_id=queue_id)
-                if matches.empty:
-                    api.logging.info('no new matches for summoner {0}'.format(summoner_name))
-                    return
-
-                query = session.query(Match).filter(Match.game_id.in_([str(n) for n in matches.game_id.values])) 
-                matches_already_loaded = pd.read_sql(sql=query.statement, con=session.bind)
-                if matches_already_loaded.empty:
-                    new_matches = matches.game_id.values
+                state = session.get(SyncState, summoner.account_id) if incremental else None
+                if state is not None:
+                    # the matches of a page are loaded before the next page is listed,
+                    # only the newest match is kept for the watermark
+                    matches = None
+                    for page in riot.iter_match_list(summoner.account_id, begin_time=datetime.fromtimestamp(state.last_timestamp / 1000)):
+                        self._load_new_matches(self._after_watermark(page, state), batch_size=batch_size)
+                        matches = pd.concat([matches, page]).nlargest(1, 'timestamp')
                 else:
-                    new_matches = matches[~matches.game_id.isin(matches_already_loaded.game_id)].game_id.values
+                    matches = riot.get_match_list(summoner.account_id, champion_id=champion_id, end_index=number_of_games, begin_time=begin_time, queue_id=queue_id)
+                    if matches.empty:
+                        api.logging.info('no new matches for summoner {0}'.format(summoner_name))
+                        return
+                    self._load_new_matches(self._new_matches(session, matches), batch_size=batch_size)
 
-                api.logging.info('{0} out of {1} are new matches'.format(len(new_matches), len(matches)))
-                for match in new_matches:
-                    try:
-                        details = self.api.get_match_details(match)
-                        for name, table in details.items():
-                            try:
-                                table.to_sql(name=name, con=session.bind, if_exists='append')
-                            except IntegrityError:
-                                pass
-                        
-                        timeline = self.api.get_timeline(match)
-                        for name, table in timeline.items():
-                            table.to_sql(name=name, con=session.bind, if_exists='append')
-                        
-                        api.logging.info('Merged {0} successfully'.format(match))
-                    except Exception as e:
-                        api.logging.error('error while gathering match details for game_id {0}'.format(match))
-                        api.logging.error(str(e))
-                        pass
+                if incremental:
+                    self._advance_watermark(session, summoner.account_id, matches)
             except NoResultFound as e:
                 api.logging.info('no new matches for summoner {0}'.format(summoner_name))
                 pass
@@ -315,26 +963,389 @@ class LeagueDB:
             api.logging.error('error while gathering summoner data for summoner {0}'.format(summoner_name))
             api.logging.error(str(e))
             pass
+        finally:
+            session.close()
+
+    async def update_summoner_async(self, summoner_name: str, number_of_games: int=100, champion_id: int=-1, begin_time: datetime=None, queue_id: int=-1, concurrency: int=10, batch_size: int=20,
+                                    platform: str=None) -> None:
+        with self._profiled('update_summoner_async', summoner_name):
+            await self._update_summoner_async(summoner_name, number_of_games=number_of_games, champion_id=champion_id, begin_time=begin_time, queue_id=queue_id,
+                                              concurrency=concurrency, batch_size=batch_size, platform=platform)
+            await asyncio.get_running_loop().run_in_executor(None, self._retry_due_jobs, batch_size)
+
+    def _retry_due_jobs(self, batch_size: int) -> None:
+        # the watermark moves past failed matches, so every sync also loads up to batch_size jobs of the queue
+        # whose backoff is over (or whose worker died). nothing else would list them again
+        try:
+            retried = self.run_worker(batch_size=batch_size, max_jobs=batch_size)
+        except Exception as e:
+            api.logging.error('error while retrying failed matches')
+            api.logging.error(str(e))
+            return
+        if retried:
+            api.logging.info('retried {0} queued matches'.format(retried))
+
+    async def _update_summoner_async(self, summoner_name: str, number_of_games: int=100, champion_id: int=-1, begin_time: datetime=None, queue_id: int=-1, concurrency: int=10, batch_size: int=20,
+                                     platform: str=None) -> None:
+        # like update_summoner, but up to `concurrency` matches are requested at once and
+        # the database writes run in a worker thread behind a queue, overlapping the network
+        api.logging.info('update summoner: {0}'.format(summoner_name))
+        loop = asyncio.get_running_loop()
+        session = self.Session()
+        incremental = begin_time is None and champion_id == -1 and queue_id == -1
+        client = self.get_api(platform)
+        async with async_api.AsyncRiotApi(client.key, base_url=client.base_url, limiter=client.limiter, pool_size=concurrency, cache=client.cache, offline=client.offline, memo=client.memo,
+                                          metrics=self.metrics, platform=client.platform) as riot:
+            try:
+                df_summoner = await riot.get_summoner_by_name(summoner_name)
+                if df_summoner.empty:
+                    api.logging.info('summoner with name {0} not found'.format(summoner_name))
+                    return
+
+                summoner = Summoner(**df_summoner.reset_index().iloc[0])
+                session.merge(summoner)
+                session.commit()
+
+                state = session.get(SyncState, summoner.account_id) if incremental else None
+                if state is None:
+                    matches = await riot.get_match_list(summoner.account_id, champion_id=champion_id, end_index=number_of_games, begin_time=begin_time, queue_id=queue_id)
+                    if matches.empty:
+                        api.logging.info('no new matches for summoner {0}'.format(summoner_name))
+                        session.close()
+                        return
+            except NoResultFound:
+                api.logging.info('no new matches for summoner {0}'.format(summoner_name))
+                session.close()
+                return
+            except Exception as e:
+                api.logging.error('error while gathering summoner data for summoner {0}'.format(summoner_name))
+                api.logging.error(str(e))
+                session.close()
+                return
+
+            queue = asyncio.Queue(maxsize=concurrency)
+            semaphore = asyncio.Semaphore(concurrency)
+            failed = {}
+
+            async def pages():
+                # yields (page, new matches of the page). an incremental sync lists the pages lazily,
+                # so the matches of a page are fetched while the next page is listed
+                if state is None:
+                    yield matches, await loop.run_in_executor(None, self._new_matches, session, matches)
+                    return
+                async for page in riot.iter_match_list(summoner.account_id, begin_time=datetime.fromtimestamp(state.last_timestamp / 1000)):
+                    yield page, self._after_watermark(page, state)
+
+            async def fetch(match: str) -> None:
+                async with semaphore:
+                    # claimed when its fetch starts, so the lease does not run out while earlier matches are fetched
+                    if not await loop.run_in_executor(None, lambda: self.claim_jobs(1, game_ids=[match])):
+                        return
+                    claimed.append(match)
+                    try:
+                        if api.split_game_id(match)[0] == riot.platform:
+                            details, timeline = await asyncio.gather(riot.get_match_raw(match), riot.get_timeline_raw(match))
+                        else:
+                            # listed matches of another platform (transferred accounts) are fetched by the client of that platform
+                            other = self.get_api(api.split_game_id(match)[0])
+                            details, timeline = await loop.run_in_executor(None, lambda: (other.get_match_raw(match), other.get_timeline_raw(match)))
+                    except Exception as e:
+                        api.logging.error('error while gathering match details for game_id {0}'.format(match))
+                        api.logging.error(str(e))
+                        failed[match] = str(e)
+                        return
+                    # the slot is held until the writer accepts the match, so a slow database throttles the fetches
+                    await queue.put((match, details, timeline))
+
+            async def write() -> None:
+                # takes everything that is queued, up to batch_size matches, per write
+                done = False
+                while not done:
+                    batch = [await queue.get()]
+                    while len(batch) < batch_size and not queue.empty():
+                        batch.append(queue.get_nowait())
+                    if batch[-1] is None:
+                        done = True
+                        batch.pop()
+                    failed.update(await loop.run_in_executor(None, self._store_batch, batch))
+
+            writer = asyncio.create_task(write())
+            claimed = []
+            fetches = []
+            # only the newest listed match is kept for the watermark, which is advanced once all pages are listed
+            newest = None
+            listed = False
+            try:
+                async for page, new_matches in pages():
+                    await loop.run_in_executor(None, self.enqueue_matches, new_matches)
+                    fetches.extend(asyncio.create_task(fetch(match)) for match in new_matches)
+                    newest = pd.concat([newest, page]).nlargest(1, 'timestamp')
+                listed = True
+            except NoResultFound:
+                api.logging.info('no new matches for summoner {0}'.format(summoner_name))
+            except Exception as e:
+                api.logging.error('error while gathering match list for summoner {0}'.format(summoner_name))
+                api.logging.error(str(e))
+
+            await asyncio.gather(*fetches)
+            await queue.put(None)
+            await writer
+            loaded = [match for match in claimed if match not in failed]
+            try:
+                await loop.run_in_executor(None, self.complete_jobs, loaded)
+            except Exception as e:
+                api.logging.error('error while completing matches for summoner {0}'.format(summoner_name))
+                api.logging.error(str(e))
+                failed.update((match, str(e)) for match in loaded)
+            try:
+                for match, error in failed.items():
+                    await loop.run_in_executor(None, self.fail_jobs, [match], error)
+                if incremental and listed:
+                    self._advance_watermark(session, summoner.account_id, newest)
+            finally:
+                session.close()
+
+    def _load_new_matches(self, new_matches: List[str], batch_size: int=20) -> None:
+        # claimed batch by batch, so the lease of a job starts shortly before it is fetched and
+        # does not run out while the earlier batches wait for the rate limit
+        self.enqueue_matches(new_matches)
+        for start in range(0, len(new_matches), batch_size):
+            chunk = new_matches[start:start + batch_size]
+            self._load_jobs(self.claim_jobs(len(chunk), game_ids=chunk), batch_size=batch_size)
+
+    def _new_matches(self, session, matches: pd.DataFrame) -> list:
+        query = session.query(Match).filter(Match.game_id.in_([int(n) for n in matches.game_id.values])) 
+        matches_already_loaded = pd.read_sql(sql=query.statement, con=session.bind)
+        if matches_already_loaded.empty:
+            new_matches = matches.game_id.values
+        else:
+            new_matches = matches[~matches.game_id.isin(matches_already_loaded.game_id)].game_id.values
+        api.logging.info('{0} out of {1} are new matches'.format(len(new_matches), len(matches)))
+        return list(new_matches)
+
+    def _after_watermark(self, matches: pd.DataFrame, state: SyncState) -> list:
+        newer = (matches.timestamp > state.last_timestamp) | ((matches.timestamp == state.last_timestamp) & (matches.game_id.astype(str) != state.last_game_id))
+        new_matches = matches[newer].game_id.values
+        api.logging.info('{0} new matches since {1}'.format(len(new_matches), state.last_game_id))
+        return list(new_matches)
+
+    def _advance_watermark(self, session, account_id: str, matches: pd.DataFrame) -> None:
+        # every listed match is in the ingestion queue, failed ones are retried from there
+        if matches.empty:
+            return
+        newest = matches.sort_values('timestamp').iloc[-1]
+        state = session.get(SyncState, account_id)
+        if state is not None and state.last_timestamp >= newest.timestamp:
+            return
+        session.merge(SyncState(account_id=account_id, last_timestamp=int(newest.timestamp), last_game_id=str(newest.game_id), updated=datetime.utcnow()))
+        session.commit()
+
+    def enqueue_matches(self, game_ids: List[str]) -> None:
+        # matches that are already queued keep their state
+        if not len(game_ids):
+            return
+        now = datetime.utcnow()
+        jobs = [{'game_id': str(game_id), 'state': JobState.PENDING.value, 'attempts': 0, 'updated': now} for game_id in game_ids]
+        with self.engine.begin() as connection:
+            connection.execute(_insert_ignore(connection, IngestionJob.__table__), jobs)
+
+    def claim_jobs(self, limit: int, game_ids: List[str]=None) -> List[str]:
+        # marks up to limit claimable jobs as in_progress for this worker. postgres skips rows locked by
+        # other workers, on other databases the conditional update per job only succeeds for one worker.
+        now = datetime.utcnow()
+        claimable = or_(
+            IngestionJob.state == JobState.PENDING.value,
+            and_(IngestionJob.state == JobState.FAILED.value, IngestionJob.attempts < self.max_attempts, IngestionJob.next_retry <= now),
+            and_(IngestionJob.state == JobState.IN_PROGRESS.value, IngestionJob.locked_until < now))
+        query = select(IngestionJob.game_id).where(claimable).limit(limit)
+        if game_ids is not None:
+            query = query.where(IngestionJob.game_id.in_([str(game_id) for game_id in game_ids]))
+        claim = dict(state=JobState.IN_PROGRESS.value, worker=self.worker, attempts=IngestionJob.attempts + 1,
+                     locked_until=now + timedelta(seconds=self.job_lease), updated=now)
+        with self.engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                claimed = connection.execute(query.with_for_update(skip_locked=True)).scalars().all()
+                if claimed:
+                    connection.execute(update(IngestionJob).where(IngestionJob.game_id.in_(claimed)).values(**claim))
+                return claimed
+            claimed = []
+            for game_id in connection.execute(query).scalars().all():
+                result = connection.execute(update(IngestionJob).where(IngestionJob.game_id == game_id, claimable).values(**claim))
+                if result.rowcount == 1:
+                    claimed.append(game_id)
+            return claimed
+
+    def complete_jobs(self, game_ids: List[str]) -> None:
+        if not game_ids:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(update(IngestionJob).where(IngestionJob.game_id.in_([str(game_id) for game_id in game_ids])).values(
+                state=JobState.DONE.value, locked_until=None, next_retry=None, error=None, updated=datetime.utcnow()))
+
+    def fail_jobs(self, game_ids: List[str], error: str) -> None:
+        now = datetime.utcnow()
+        with self.engine.begin() as connection:
+            jobs = connection.execute(select(IngestionJob.game_id, IngestionJob.attempts).where(IngestionJob.game_id.in_([str(game_id) for game_id in game_ids]))).all()
+            for game_id, attempts in jobs:
+                # no retry is scheduled once max_attempts is reached
+                next_retry = now + timedelta(seconds=self.retry_delay * 2 ** max(0, attempts - 1)) if attempts < self.max_attempts else None
+                connection.execute(update(IngestionJob).where(IngestionJob.game_id == game_id).values(
+                    state=JobState.FAILED.value, locked_until=None, next_retry=next_retry, error=error[:1000], updated=now))
+
+    def get_job_counts(self) -> Dict[str, int]:
+        with self.engine.connect() as connection:
+            counts = dict(connection.execute(select(IngestionJob.state, func.count()).group_by(IngestionJob.state)).all())
+        return {state.value: counts.get(state.value, 0) for state in JobState}
+
+    def get_ladder_summoners(self) -> List[str]:
+        # summoner names of the challenger leaderboards written by update_static_data, solo queue first
+        names = []
+        for name in ('leaderboard_solo', 'leaderboard_flex'):
+            if inspect(self.engine).has_table(name):
+                names.extend(pd.read_sql(sql='SELECT summoner_name FROM {0}'.format(name), con=self.engine).summoner_name)
+        return list(dict.fromkeys(names))
+
+    def get_co_players(self, account_id: str) -> pd.DataFrame:
+        # account_id and summoner_name of everyone who played a loaded match together with the account
+        games = select(Participant.game_id).where(Participant.account_id == account_id)
+        query = select(Participant.account_id, Participant.summoner_name).where(Participant.game_id.in_(games), Participant.account_id != account_id).distinct()
+        return pd.read_sql(sql=query, con=self.engine).dropna()
+
+    def run_worker(self, batch_size: int=20, max_jobs: int=None, poll_interval: float=5, wait: bool=False) -> int:
+        # drains the ingestion queue, several workers can run in parallel on the same database.
+        # without wait the worker stops once nothing is claimable.
+        done = 0
+        while max_jobs is None or done < max_jobs:
+            limit = batch_size if max_jobs is None else min(batch_size, max_jobs - done)
+            game_ids = self.claim_jobs(limit)
+            if not game_ids:
+                if not wait:
+                    break
+                sleep(poll_interval)
+                continue
+            self._load_jobs(game_ids, batch_size=batch_size)
+            done += len(game_ids)
+        return done
+
+    def _load_jobs(self, game_ids: List[str], batch_size: int=20) -> None:
+        for start in range(0, len(game_ids), batch_size):
+            payloads = []
+            for game_id in game_ids[start:start + batch_size]:
+                try:
+                    # every match is fetched from the platform of its game_id key
+                    riot = self.get_api(api.split_game_id(game_id)[0])
+                    with self.metrics.time('pyleague_stage_seconds', stage='fetch'):
+                        payloads.append((game_id, riot.get_match_raw(game_id), riot.get_timeline_raw(game_id)))
+                except Exception as e:
+                    api.logging.error('error while gathering match details for game_id {0}'.format(game_id))
+                    api.logging.error(str(e))
+                    self.fail_jobs([game_id], str(e))
+            failed = self._store_batch(payloads)
+            for game_id, error in failed.items():
+                self.fail_jobs([game_id], error)
+            self.complete_jobs([game_id for game_id, _, _ in payloads if game_id not in failed])
+
+    def reload_matches(self, game_ids: List[str], batch_size: int=20) -> None:
+        # rewrites matches from the response cache (or riot when it is missing there), e.g. after a schema change
+        payloads = []
+        for game_id in game_ids:
+            try:
+                riot = self.get_api(api.split_game_id(game_id)[0])
+                payloads.append((game_id, riot.get_match_raw(game_id), riot.get_timeline_raw(game_id)))
+            except Exception as e:
+                api.logging.error('error while gathering match details for game_id {0}'.format(game_id))
+                api.logging.error(str(e))
+            if len(payloads) >= batch_size:
+                self._write_matches(payloads)
+                payloads = []
+        self._write_matches(payloads)
+        self._flush()
+
+    def _write_matches(self, payloads: List[Tuple[str, dict, dict]]) -> None:
+        # parses a batch of (game_id, match, timeline) payloads into one frame per table for the bulk writer
+        if not payloads:
+            return
+        frames = self.api.parse_matches([match for _, match, _ in payloads])
+        timelines = [self.api.parse_timeline(game_id, timeline) for game_id, _, timeline in payloads]
+        for name in TIMELINE_TABLES:
+            frames[name] = pd.concat([timeline[name] for timeline in timelines])
+        denormalize_timelines(frames)
+        frames['match_features'] = match_features(frames)
+        self.writer.add(frames)
+        api.logging.info('Parsed {0}'.format(', '.join(str(game_id) for game_id, _, _ in payloads)))
+
+    def _store_batch(self, payloads: List[Tuple[str, dict, dict]]) -> Dict[str, str]:
+        # stores a batch in one transaction. when that fails the matches are stored one by one, so a bad
+        # match only fails itself. returns the error of every match that could not be stored
+        if not payloads:
+            return {}
+        try:
+            self._store_matches(payloads)
+            return {}
+        except Exception as e:
+            game_ids = ', '.join(str(game_id) for game_id, _, _ in payloads)
+            if len(payloads) == 1:
+                api.logging.error('error while writing match details for game_id {0}'.format(game_ids))
+                api.logging.error(str(e))
+                return {payloads[0][0]: str(e)}
+            api.logging.warning('error while writing match details for game_ids {0}, writing them one by one: {1}'.format(game_ids, str(e)))
+        failed = {}
+        for payload in payloads:
+            failed.update(self._store_batch([payload]))
+        return failed
+
+    def _store_matches(self, payloads: List[Tuple[str, dict, dict]]) -> None:
+        # all tables of the batch are committed together or not at all
+        self._write_matches(payloads)
+        self._flush()
+
+    def _flush(self) -> None:
+        rows = self.writer.flush()
+        if rows:
+            api.logging.info('Merged {0} rows successfully'.format(rows))
 
     def update_static_data(self) -> None:
-        self._update_challenger_leaderboard()
-        print('leaderboards have been created')
-        self._update_champions()
-        print('champions have been created')
-        self._update_queue_types()
-        print('queues have been updated')
-
-    def _update_challenger_leaderboard(self) -> None:
+        if self._update_challenger_leaderboard():
+            print('leaderboards have been created')
+        else:
+            print('leaderboards are unchanged')
+        if self._update_champions():
+            print('champions have been created')
+        else:
+            print('champions are unchanged')
+        if self._update_queue_types():
+            print('queues have been updated')
+        else:
+            print('queues are unchanged')
+
+    def _replace_static_table(self, name: str, table: pd.DataFrame) -> bool:
+        # the table is only replaced when its content differs from the last replacement
+        digest = hashlib.sha1(table.to_csv().encode()).hexdigest()
+        StaticDataVersion.__table__.create(self.engine, checkfirst=True)
+        session = self.Session()
+        try:
+            version = session.get(StaticDataVersion, name)
+            if version is not None and version.digest == digest and inspect(self.engine).has_table(name):
+                api.logging.info('static data {0} is unchanged'.format(name))
+                return False
+            table.to_sql(name=name, con=self.engine, if_exists='replace')
+            session.merge(StaticDataVersion(name=name, digest=digest, updated=datetime.utcnow()))
+            session.commit()
+            return True
+        finally:
+            session.close()
+
+    def _update_challenger_leaderboard(self) -> bool:
         solo = self.api.get_leaderboard(api.QueueType.RANKED_SOLO)
-        solo.to_sql(name='leaderboard_solo', con=self.engine, if_exists='replace')
+        replaced = self._replace_static_table('leaderboard_solo', solo)
 
         flex = self.api.get_leaderboard(api.QueueType.RANKED_FLEX)
-        flex.to_sql(name='leaderboard_flex', con=self.engine, if_exists='replace')
+        return self._replace_static_table('leaderboard_flex', flex) or replaced
 
-    def _update_champions(self) -> None:
+    def _update_champions(self) -> bool:
         champions = self.api.get_champion_json()
-        champions.to_sql(name='champions', con=self.engine, if_exists='replace')
+        return self._replace_static_table('champions', champions)
     
-    def _update_queue_types(self) -> None:
+    def _update_queue_types(self) -> bool:
         queues = self.api.get_queue_types()
-        queues.to_sql(name='queues', con=self.engine, if_exists='replace')
\ No newline at end of file
+        return self._replace_static_table('queues', queues)
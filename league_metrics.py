@@ -0,0 +1,112 @@
+import os
+import re
+import json
+import cProfile
+import threading
+from bisect import bisect_left
+from itertools import accumulate
+from contextlib import contextmanager
+from time import monotonic, time
+from typing import Callable, Dict, Tuple
+
+
+class Metrics:
+    # counters and histograms with labels, shared by RiotApi and LeagueDB. exported as prometheus
+    # text exposition format or json. histograms have cumulative buckets like prometheus histograms.
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, buckets: Tuple[float, ...]=BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def __key(name: str, labels: Dict[str, str]) -> tuple:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float=1, **labels) -> None:
+        key = self.__key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self.__key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, monotonic() - start, **labels)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels), 'sum': histogram['sum'], 'count': histogram['count'],
+                           'buckets': dict(zip(map(str, self.buckets), accumulate(histogram['buckets'])))} for (name, labels), histogram in sorted(self.histograms.items())]
+        return {'counters': counters, 'histograms': histograms}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    @staticmethod
+    def __labels(labels: tuple, **extra) -> str:
+        pairs = list(labels) + list(extra.items())
+        if not pairs:
+            return ''
+        return '{' + ','.join('{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in pairs) + '}'
+
+    def to_prometheus(self) -> str:
+        lines = []
+        typed = set()
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append('# TYPE {0} counter'.format(name))
+                    typed.add(name)
+                lines.append('{0}{1} {2}'.format(name, self.__labels(labels), value))
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append('# TYPE {0} histogram'.format(name))
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    cumulative += count
+                    lines.append('{0}_bucket{1} {2}'.format(name, self.__labels(labels, le=bound), cumulative))
+                lines.append('{0}_bucket{1} {2}'.format(name, self.__labels(labels, le='+Inf'), histogram['count']))
+                lines.append('{0}_sum{1} {2}'.format(name, self.__labels(labels), histogram['sum']))
+                lines.append('{0}_count{1} {2}'.format(name, self.__labels(labels), histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def cprofile_hook(directory: str) -> Callable:
+    # profiling hook for LeagueDB.add_profiler, writes one cProfile file per run
+    os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def hook(run: str, name: str):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(directory, '{0}-{1}-{2}.prof'.format(run, re.sub(r'\W', '_', name), int(time()))))
+
+    return hook
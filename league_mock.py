@@ -0,0 +1,351 @@
+import os
+import json
+import random
+import hashlib
+import threading
+from time import monotonic, sleep
+import requests
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+STATS = '''win item0 item1 item2 item3 item4 item5 item6 kills deaths assists largest_killing_spree largest_multi_kill killing_sprees
+longest_time_spent_living double_kills triple_kills quadra_kills penta_kills unreal_kills total_damage_dealt magic_damage_dealt
+physical_damage_dealt true_damage_dealt largest_critical_strike total_damage_dealt_to_champions magic_damage_dealt_to_champions
+physical_damage_dealt_to_champions true_damage_dealt_to_champions total_heal total_units_healed damage_self_mitigated
+damage_dealt_to_objectives damage_dealt_to_turrets vision_score time_c_cing_others total_damage_taken magical_damage_taken
+physical_damage_taken true_damage_taken gold_earned gold_spent turret_kills inhibitor_kills total_minions_killed neutral_minions_killed
+neutral_minions_killed_team_jungle neutral_minions_killed_enemy_jungle total_time_crowd_control_dealt champ_level
+vision_wards_bought_in_game sight_wards_bought_in_game wards_placed wards_killed first_blood_kill first_blood_assist first_tower_kill
+first_tower_assist first_inhibitor_kill first_inhibitor_assist combat_player_score objective_player_score total_player_score
+total_score_rank player_score0 player_score1 player_score2 player_score3 player_score4 player_score5 player_score6 player_score7
+player_score8 player_score9 perk0 perk0_var1 perk0_var2 perk0_var3 perk1 perk1_var1 perk1_var2 perk1_var3 perk2 perk2_var1 perk2_var2
+perk2_var3 perk3 perk3_var1 perk3_var2 perk3_var3 perk4 perk4_var1 perk4_var2 perk4_var3 perk5 perk5_var1 perk5_var2 perk5_var3
+perk_primary_style perk_sub_style stat_perk0 stat_perk1 stat_perk2'''.split()
+POSITIONS = [('TOP', 'SOLO'), ('JUNGLE', 'NONE'), ('MIDDLE', 'SOLO'), ('BOTTOM', 'DUO_CARRY'), ('BOTTOM', 'DUO_SUPPORT')]
+FIRST_GAME_CREATION = 1606000000000
+
+
+def camel_case(snake_case: str) -> str:
+    head, *tail = snake_case.split('_')
+    return head + ''.join(part[:1].upper() + part[1:] for part in tail)
+
+
+def generate_match(game_id: int, platform_id: str='EUW1') -> dict:
+    # synthetic match-v4 payload, deterministic for a game_id
+    rng = random.Random(game_id)
+    duration = rng.randint(1200, 2700)
+    champions = rng.sample(range(1, 900), 20)
+    win = rng.choice([100, 200])
+    teams, participants, identities = [], [], []
+    for team_id in (100, 200):
+        teams.append({
+            'teamId': team_id, 'win': 'Win' if team_id == win else 'Fail',
+            'firstBlood': rng.random() < 0.5, 'firstTower': rng.random() < 0.5, 'firstInhibitor': team_id == win,
+            'firstBaron': rng.random() < 0.5, 'firstDragon': rng.random() < 0.5, 'firstRiftHerald': rng.random() < 0.5,
+            'towerKills': rng.randint(0, 11), 'inhibitorKills': rng.randint(0, 3), 'baronKills': rng.randint(0, 2),
+            'dragonKills': rng.randint(0, 5), 'vilemawKills': 0, 'riftHeraldKills': rng.randint(0, 2), 'dominionVictoryScore': 0,
+            'bans': [{'championId': champions[10 + (team_id == 200) * 5 + turn], 'pickTurn': turn + 1 + (team_id == 200) * 5} for turn in range(5)],
+        })
+        for lane, role in POSITIONS:
+            participant_id = len(participants) + 1
+            stats = {camel_case(name): rng.randint(0, 30000) for name in STATS}
+            stats.update({key: rng.random() < 0.2 for key in stats if key.startswith('first')})
+            stats.update({'participantId': participant_id, 'win': team_id == win, 'champLevel': rng.randint(8, 18)})
+            participants.append({
+                'participantId': participant_id, 'teamId': team_id, 'championId': champions[participant_id - 1],
+                'spell1Id': 4, 'spell2Id': rng.choice([7, 11, 12, 14]), 'stats': stats,
+                'timeline': {'participantId': participant_id, 'creepsPerMinDeltas': {'0-10': rng.random() * 10}, 'role': role, 'lane': lane},
+            })
+            account = 'account-{0}'.format(rng.randint(0, 9999))
+            identities.append({'participantId': participant_id, 'player': {
+                'platformId': platform_id, 'accountId': account, 'summonerName': 'player' + account[8:], 'summonerId': 'summoner' + account[7:],
+                'currentPlatformId': platform_id, 'currentAccountId': account, 'matchHistoryUri': '/v1/stats/player_history/' + platform_id + '/1',
+                'profileIcon': rng.randint(1, 4000)}})
+    return {
+        'gameId': game_id, 'platformId': platform_id, 'gameCreation': FIRST_GAME_CREATION + game_id % 100000 * 60000,
+        'gameDuration': duration, 'queueId': 420, 'mapId': 11, 'seasonId': 13, 'gameVersion': '10.23.343.2581',
+        'gameMode': 'CLASSIC', 'gameType': 'MATCHED_GAME',
+        'teams': teams, 'participants': participants, 'participantIdentities': identities,
+    }
+
+
+def generate_timeline(game_id: int, minutes: int=None) -> dict:
+    # synthetic timeline payload with one frame per minute, deterministic for a game_id
+    rng = random.Random(game_id)
+    minutes = minutes if minutes is not None else rng.randint(1200, 2700) // 60
+    gold = [500] * 10
+    xp = [0] * 10
+    cs = [0] * 10
+    frames = []
+    for minute in range(minutes + 1):
+        timestamp = minute * 60000 + (rng.randint(0, 40) if minute else 0)
+        participant_frames = {}
+        for index in range(10):
+            gold[index] += rng.randint(250, 500) if minute else 0
+            xp[index] += rng.randint(300, 600) if minute else 0
+            cs[index] += rng.randint(4, 10) if minute else 0
+            participant_frames[str(index + 1)] = {
+                'participantId': index + 1, 'position': {'x': rng.randint(0, 14820), 'y': rng.randint(0, 14881)},
+                'currentGold': rng.randint(0, 1500), 'totalGold': gold[index], 'level': min(18, 1 + xp[index] // 1000),
+                'xp': xp[index], 'minionsKilled': cs[index], 'jungleMinionsKilled': cs[index] // 8, 'dominionScore': 0, 'teamScore': 0,
+            }
+        events = []
+        for _ in range(rng.randint(5, 25) if minute else 0):
+            stamp = (minute - 1) * 60000 + rng.randint(0, 59999)
+            participant = rng.randint(1, 10)
+            kind = rng.choice(['ITEM_PURCHASED', 'ITEM_PURCHASED', 'ITEM_DESTROYED', 'ITEM_SOLD', 'ITEM_UNDO', 'SKILL_LEVEL_UP',
+                               'WARD_PLACED', 'WARD_KILL', 'CHAMPION_KILL', 'BUILDING_KILL', 'ELITE_MONSTER_KILL'])
+            if kind in ('ITEM_PURCHASED', 'ITEM_DESTROYED', 'ITEM_SOLD'):
+                event = {'participantId': participant, 'itemId': rng.choice([1001, 1055, 2003, 3006, 3031, 3071, 3340])}
+            elif kind == 'ITEM_UNDO':
+                event = {'participantId': participant, 'afterId': 0, 'beforeId': rng.choice([1001, 2003])}
+            elif kind == 'SKILL_LEVEL_UP':
+                event = {'participantId': participant, 'skillSlot': rng.randint(1, 4), 'levelUpType': 'NORMAL'}
+            elif kind == 'WARD_PLACED':
+                event = {'creatorId': participant, 'wardType': rng.choice(['YELLOW_TRINKET', 'CONTROL_WARD', 'SIGHT_WARD'])}
+            elif kind == 'WARD_KILL':
+                event = {'killerId': participant, 'wardType': rng.choice(['YELLOW_TRINKET', 'CONTROL_WARD'])}
+            elif kind == 'CHAMPION_KILL':
+                event = {'killerId': participant, 'victimId': (participant + 4) % 10 + 1, 'assistingParticipantIds': rng.sample(range(1, 11), rng.randint(0, 3)),
+                         'position': {'x': rng.randint(0, 14820), 'y': rng.randint(0, 14881)}}
+            elif kind == 'BUILDING_KILL':
+                event = {'killerId': participant, 'teamId': rng.choice([100, 200]), 'buildingType': 'TOWER_BUILDING', 'laneType': rng.choice(['TOP_LANE', 'MID_LANE', 'BOT_LANE']),
+                         'towerType': rng.choice(['OUTER_TURRET', 'INNER_TURRET']), 'assistingParticipantIds': [], 'position': {'x': rng.randint(0, 14820), 'y': rng.randint(0, 14881)}}
+            else:
+                event = {'killerId': participant, 'monsterType': 'DRAGON', 'monsterSubType': rng.choice(['FIRE_DRAGON', 'AIR_DRAGON']),
+                         'position': {'x': 9866, 'y': 4414}}
+            event.update({'type': kind, 'timestamp': stamp})
+            events.append(event)
+        events.sort(key=lambda event: event['timestamp'])
+        frames.append({'participantFrames': participant_frames, 'events': events, 'timestamp': timestamp})
+    return {'frames': frames, 'frameInterval': 60000}
+
+
+def generate_league(queue: str, players: int=300) -> dict:
+    # synthetic challenger league of a queue
+    rng = random.Random(queue)
+    entries = [{'summonerId': 'summoner-player{0}'.format(index), 'summonerName': 'player{0}'.format(index), 'leaguePoints': rng.randint(500, 1500),
+                'rank': 'I', 'wins': rng.randint(100, 400), 'losses': rng.randint(100, 400), 'veteran': rng.random() < 0.5, 'inactive': False,
+                'freshBlood': rng.random() < 0.1, 'hotStreak': rng.random() < 0.2} for index in rng.sample(range(10000), players)]
+    return {'tier': 'CHALLENGER', 'leagueId': 'league-' + queue, 'queue': queue, 'name': 'Mock Challengers', 'entries': entries}
+
+
+def generate_match_list(account_id: str, begin_index: int=0, end_index: int=100, begin_time: int=None, games: int=250, platform_id: str='EUW1') -> dict:
+    # synthetic matchlist of an account, newest game first
+    rng = random.Random(account_id)
+    first = rng.randint(1, 10 ** 6) * 1000
+    matches = [{'platformId': platform_id, 'gameId': first + games - index, 'champion': rng.randint(1, 900), 'queue': 420, 'season': 13,
+                'timestamp': FIRST_GAME_CREATION + (first + games - index) % 100000 * 60000, 'role': 'SOLO', 'lane': 'TOP'}
+               for index in range(games)]
+    matches.sort(key=lambda match: match['timestamp'], reverse=True)
+    if begin_time is not None:
+        matches = [match for match in matches if match['timestamp'] >= begin_time]
+    page = matches[begin_index:end_index]
+    return {'matches': page, 'startIndex': begin_index, 'endIndex': begin_index + len(page), 'totalGames': len(matches)}
+
+
+def generate_queues() -> list:
+    # synthetic queues.json of the static data cdn
+    return [{'queueId': queue_id, 'map': map_name, 'description': description, 'notes': None} for queue_id, map_name, description in
+            [(0, 'Custom games', None), (400, "Summoner's Rift", '5v5 Draft Pick games'), (420, "Summoner's Rift", '5v5 Ranked Solo games'),
+             (430, "Summoner's Rift", '5v5 Blind Pick games'), (440, "Summoner's Rift", '5v5 Ranked Flex games'), (450, 'Howling Abyss', '5v5 ARAM games')]]
+
+
+def generate_champions(version: str, champions: int=150) -> dict:
+    # synthetic champion.json of data dragon
+    rng = random.Random(version)
+    data = {}
+    for key in range(1, champions + 1):
+        name = 'Champion{0}'.format(key)
+        data[name] = {
+            'version': version, 'id': name, 'key': str(key), 'name': name, 'title': 'the synthetic', 'blurb': '',
+            'info': {'attack': rng.randint(1, 10), 'defense': rng.randint(1, 10), 'magic': rng.randint(1, 10), 'difficulty': rng.randint(1, 10)},
+            'image': {'full': name + '.png', 'sprite': 'champion0.png', 'group': 'champion', 'x': 0, 'y': 0, 'w': 48, 'h': 48},
+            'tags': rng.sample(['Fighter', 'Tank', 'Mage', 'Assassin', 'Marksman', 'Support'], 2), 'partype': 'Mana',
+            'stats': {'hp': rng.randint(500, 650), 'hpperlevel': rng.randint(80, 110), 'mp': rng.randint(0, 500), 'movespeed': rng.choice([325, 330, 335, 340, 345]),
+                      'armor': rng.randint(18, 40), 'attackrange': rng.choice([125, 175, 500, 550, 650]), 'attackdamage': rng.randint(50, 70)},
+        }
+    return {'type': 'champion', 'format': 'standAloneComplex', 'version': version, 'data': data}
+
+
+class FixedWindow:
+    # riot style rate limit window: opened by the first request, reset after `window` seconds
+    def __init__(self, limit: int, window: int) -> None:
+        self.limit = limit
+        self.window = window
+        self.start = None
+        self.count = 0
+
+    def hit(self, now: float) -> bool:
+        if self.start is None or now >= self.start + self.window:
+            self.start = now
+            self.count = 0
+        if self.count >= self.limit:
+            return False
+        self.count += 1
+        return True
+
+    def retry_after(self, now: float) -> int:
+        return max(1, int(self.start + self.window - now + 0.999))
+
+
+class MockRiotServer:
+    # local stand-in for the riot api and the static data cdns that enforces an application rate limit.
+    # responses are replayed from `recordings` when a recording of the path exists, otherwise they are fetched
+    # from `upstream` and recorded (with api_key) or generated. latency, 429 responses with Retry-After and
+    # 504 responses can be injected into the riot endpoints, the static data is served without.
+    def __init__(self, host: str='127.0.0.1', port: int=0, app_limits: str='20:1,100:120', latency: float=0.0, rate_429: float=0.0,
+                 rate_504: float=0.0, retry_after: int=1, recordings: str=None, upstream: str=None, api_key: str=None, seed: int=None,
+                 platform_id: str='EUW1') -> None:
+        self.app_limits = app_limits
+        self.platform_id = platform_id
+        self.windows = [FixedWindow(int(limit), int(window)) for limit, window in (item.split(':') for item in app_limits.split(','))]
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+        self.injected = {429: 0, 504: 0}
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.rate_504 = rate_504
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.recordings = recordings
+        self.upstream = upstream
+        self.api_key = api_key
+        if recordings is not None:
+            os.makedirs(recordings, exist_ok=True)
+        self.server = ThreadingHTTPServer((host, port), self.__handler())
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def start(self) -> 'MockRiotServer':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'MockRiotServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def admit(self) -> (bool, dict):
+        with self.lock:
+            now = monotonic()
+            self.requests += 1
+            headers = {'X-App-Rate-Limit': self.app_limits}
+            for window in self.windows:
+                if not window.hit(now):
+                    self.rejected += 1
+                    headers.update({'Retry-After': str(window.retry_after(now)), 'X-Rate-Limit-Type': 'application'})
+                    return False, headers
+            headers['X-App-Rate-Limit-Count'] = ','.join('{0}:{1}'.format(w.count, w.window) for w in self.windows)
+            return True, headers
+
+    def inject(self) -> (int, dict):
+        # a random 429 of the service or 504, or None
+        with self.lock:
+            draw = self.random.random()
+            if draw < self.rate_429:
+                self.injected[429] += 1
+                return 429, {'Retry-After': str(self.retry_after)}
+            if draw < self.rate_429 + self.rate_504:
+                self.injected[504] += 1
+                return 504, {}
+        return None, {}
+
+    def __recording(self, path: str) -> str:
+        return os.path.join(self.recordings, hashlib.sha1(path.encode()).hexdigest() + '.json')
+
+    def replay(self, path: str) -> (int, dict):
+        if self.recordings is not None:
+            try:
+                with open(self.__recording(path), encoding='utf-8') as file:
+                    recording = json.load(file)
+                return recording['status'], recording['body']
+            except FileNotFoundError:
+                pass
+        if self.upstream is not None:
+            r = requests.get(self.upstream + path, headers={'X-Riot-Token': self.api_key} if self.api_key else {})
+            status, body = r.status_code, r.json()
+        else:
+            status, body = self.respond(path)
+        if self.recordings is not None and status in (200, 404):
+            temporary = '{0}.{1}.tmp'.format(self.__recording(path), threading.get_ident())
+            with open(temporary, 'w', encoding='utf-8') as file:
+                json.dump({'path': path, 'status': status, 'body': body}, file)
+            os.replace(temporary, self.__recording(path))
+        return status, body
+
+    @staticmethod
+    def is_static(path: str) -> bool:
+        return path.startswith('/docs/') or path.startswith('/cdn/')
+
+    def respond(self, path: str) -> (int, dict):
+        url = urlsplit(path)
+        if url.path == '/docs/lol/queues.json':
+            return 200, generate_queues()
+        elif url.path.startswith('/cdn/') and url.path.endswith('/champion.json'):
+            return 200, generate_champions(url.path.split('/')[2])
+        params = {key: int(value[0]) for key, value in parse_qs(url.query).items()}
+        key = url.path.rsplit('/', 1)[-1]
+        if url.path.startswith('/lol/summoner/v4/summoners/'):
+            return 200, {'id': 'summoner-' + key, 'accountId': 'account-' + key, 'puuid': 'puuid-' + key, 'name': key,
+                         'profileIconId': 1, 'revisionDate': FIRST_GAME_CREATION, 'summonerLevel': 100}
+        elif url.path.startswith('/lol/match/v4/matchlists/by-account/'):
+            result = generate_match_list(key, params.get('beginIndex', 0), params.get('endIndex', 100), params.get('beginTime'), platform_id=self.platform_id)
+            if not result['matches']:
+                return 404, {'status': {'message': 'Data not found', 'status_code': 404}}
+            return 200, result
+        elif url.path.startswith('/lol/league/v4/challengerleagues/by-queue/'):
+            return 200, generate_league(key)
+        elif url.path.startswith('/lol/match/v4/matches/'):
+            return 200, generate_match(int(key), platform_id=self.platform_id)
+        elif url.path.startswith('/lol/match/v4/timelines/by-match/'):
+            return 200, generate_timeline(int(key))
+        return 404, {'status': {'message': 'Data not found', 'status_code': 404}}
+
+    def __handler(self) -> type:
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                if mock.is_static(self.path):
+                    admitted, headers = True, {}
+                else:
+                    if mock.latency:
+                        sleep(mock.latency * mock.random.uniform(0.5, 1.5))
+                    admitted, headers = mock.admit()
+                injected, injected_headers = mock.inject() if admitted and not mock.is_static(self.path) else (None, {})
+                if not admitted:
+                    status, body = 429, {'status': {'message': 'Rate limit exceeded', 'status_code': 429}}
+                elif injected is not None:
+                    headers.update(injected_headers)
+                    status, body = injected, {'status': {'message': 'Injected error', 'status_code': injected}}
+                else:
+                    status, body = mock.replay(self.path)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
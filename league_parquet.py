@@ -0,0 +1,123 @@
+import os
+import uuid
+from enum import Enum
+from typing import Dict, List
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, inspect, Integer, SmallInteger, Boolean, DateTime, Enum as SqlEnum
+import league_api as api
+import league_database as database
+
+
+PARTITION_COLUMNS = ['patch', 'queue_id']
+
+def _arrow_type(column) -> pa.DataType:
+    if isinstance(column.type, SqlEnum):
+        return pa.string()
+    elif isinstance(column.type, SmallInteger):
+        return pa.int16()
+    elif isinstance(column.type, Integer):
+        return pa.int64()
+    elif isinstance(column.type, Boolean):
+        return pa.bool_()
+    elif isinstance(column.type, DateTime):
+        return pa.timestamp('ms')
+    return pa.string()
+
+
+class ParquetStore:
+    # the match tables as parquet datasets, one directory per table partitioned by patch and queue_id
+    # (hive layout, e.g. stats/patch=10.23/queue_id=420/part-<uuid>-0.parquet). every file is written with
+    # the schema of the table model, so files of different batches always have the same columns and types.
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.tables = {table.name: table for table in database.match_tables()}
+        self.schemas = {name: pa.schema([pa.field(column.name, _arrow_type(column)) for column in table.columns if column.name not in PARTITION_COLUMNS] +
+                                        [pa.field('patch', pa.string()), pa.field('queue_id', pa.int16())])
+                        for name, table in self.tables.items()}
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def has_table(self, name: str) -> bool:
+        return os.path.isdir(self.__path(name))
+
+    def read(self, name: str, columns: List[str]=None, filters=None) -> pd.DataFrame:
+        # only the requested columns are read, and filters on patch and queue_id skip whole partitions.
+        # filters are a pyarrow expression or a list of (column, op, value) tuples like in pyarrow.parquet.read_table
+        table = pq.read_table(self.__path(name), columns=columns, filters=filters, partitioning='hive')
+        return table.to_pandas()
+
+    def game_ids(self) -> set:
+        # matches are written last, a game is complete in the store once it is in matches
+        if not self.has_table('matches'):
+            return set()
+        return set(self.read('matches', columns=['game_id']).game_id)
+
+    def __conform(self, name: str, frame: pd.DataFrame, partitions: pd.DataFrame) -> pa.Table:
+        frame = frame.reset_index()
+        frame = frame.drop(columns=[column for column in PARTITION_COLUMNS if column in frame])
+        frame = frame.join(partitions, on='game_id')
+        schema = self.schemas[name]
+        frame = frame.reindex(columns=schema.names)
+        for column in frame.columns:
+            if isinstance(frame[column].dtype, pd.CategoricalDtype):
+                frame[column] = frame[column].astype(object)
+            # enum columns read from the database hold enum members, the parsers emit their labels
+            elif column in self.tables[name].c and isinstance(self.tables[name].c[column].type, SqlEnum):
+                frame[column] = frame[column].map(lambda value: value.value if isinstance(value, Enum) else value, na_action='ignore')
+        return pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+    def write(self, frames: Dict[str, pd.DataFrame]) -> int:
+        # frames of RiotApi.parse_matches and parse_timeline, or rows read from the database
+        games = frames['matches'].reset_index().set_index('game_id')
+        partitions = pd.DataFrame({'patch': games.game_version.str.split('.').str[:2].str.join('.'), 'queue_id': games.queue_id})
+        batch = uuid.uuid4().hex
+        rows = 0
+        for name in sorted(frames, key=lambda name: name == 'matches'):
+            if name not in self.tables or frames[name].empty:
+                continue
+            table = self.__conform(name, frames[name], partitions)
+            pq.write_to_dataset(table, self.__path(name), partition_cols=PARTITION_COLUMNS, basename_template='part-' + batch + '-{i}.parquet')
+            rows += table.num_rows
+        return rows
+
+    def ingest(self, riot: api.RiotApi, game_ids: List[str], batch_size: int=100) -> int:
+        # writes matches and timelines of the api straight to the store, without a database
+        known = self.game_ids()
+        game_ids = [game_id for game_id in game_ids if int(game_id) not in known]
+        written = 0
+        for start in range(0, len(game_ids), batch_size):
+            payloads = []
+            for game_id in game_ids[start:start + batch_size]:
+                try:
+                    payloads.append((game_id, riot.get_match_raw(game_id), riot.get_timeline_raw(game_id)))
+                except Exception as e:
+                    api.logging.error('error while gathering match details for game_id {0}'.format(game_id))
+                    api.logging.error(str(e))
+            if not payloads:
+                continue
+            frames = riot.parse_matches([match for _, match, _ in payloads])
+            timelines = [riot.parse_timeline(game_id, timeline) for game_id, _, timeline in payloads]
+            for name in database.TIMELINE_TABLES:
+                frames[name] = pd.concat([timeline[name] for timeline in timelines])
+            database.denormalize_timelines(frames)
+            frames['match_features'] = database.match_features(frames)
+            self.write(frames)
+            written += len(payloads)
+        return written
+
+    def export(self, engine, chunk_size: int=1000) -> int:
+        # appends the matches of the database that are not in the store yet. a chunk that was interrupted
+        # before its matches were written is exported again, its other rows may then be in the store twice.
+        known = self.game_ids()
+        existing = [table for table in self.tables.values() if inspect(engine).has_table(table.name)]
+        game_ids = [game_id for game_id in pd.read_sql(sql=select(database.Match.game_id), con=engine).game_id if game_id not in known]
+        for start in range(0, len(game_ids), chunk_size):
+            chunk = [int(game_id) for game_id in game_ids[start:start + chunk_size]]
+            frames = {table.name: pd.read_sql(sql=select(table).where(table.c.game_id.in_(chunk)), con=engine) for table in existing}
+            self.write(frames)
+            api.logging.info('exported {0} of {1} matches to parquet'.format(min(start + chunk_size, len(game_ids)), len(game_ids)))
+        return len(game_ids)
@@ -0,0 +1,60 @@
+import copy
+import league_api as api
+import league_database as database
+from league_mock import generate_match, generate_timeline
+
+
+def test_match_features_skip_end_of_game_frame():
+    # a game ending at 15:40 has a second frame in minute 15, the values at 15 are the ones of the 15:00 frame
+    riot = api.RiotApi('test')
+    timeline = generate_timeline(1, minutes=15)
+    end = copy.deepcopy(timeline['frames'][-1])
+    end['timestamp'] = 15 * 60000 + 40000
+    end['events'] = []
+    for participant in end['participantFrames'].values():
+        participant['totalGold'] += 100000
+    timeline['frames'].append(end)
+    frames = riot.parse_match_details(generate_match(1))
+    frames.update(riot.parse_timeline(1, timeline))
+
+    features = database.match_features(frames).droplevel('game_id')
+    gold = {frame['participantId']: frame['totalGold'] for frame in timeline['frames'][15]['participantFrames'].values()}
+    assert features.gold_15.to_dict() == gold
+    # the participants of the same lane and role are paired, the jungle too
+    assert features.opponent_id.to_dict() == {participant: (participant + 4) % 10 + 1 for participant in range(1, 11)}
+    assert features.loc[1, 'gold_diff_15'] == gold[1] - gold[6]
+    assert features.gold_20.isna().all()
+
+
+def test_rekey_games(tmp_path):
+    # a database of a single NA1 deployment keyed by the riot game ids
+    db = database.LeagueDB('sqlite:///' + str(tmp_path / 'league.db'), 'test', cache_dir=str(tmp_path / 'cache'), platform='NA1')
+    db.create_db_layout()
+    frames = db.api.parse_match_details(generate_match(1))
+    frames.update(db.api.parse_timeline(1, generate_timeline(1, minutes=20)))
+    frames['matches']['platform_id'] = 'NA1'
+    database.denormalize_timelines(frames)
+    frames['match_features'] = database.match_features(frames)
+    db.writer.add(frames)
+    db.writer.flush()
+    # match 2 is queued but not loaded yet
+    db.enqueue_matches([1, 2])
+    with db.engine.begin() as connection:
+        connection.execute(database.insert(database.SyncState), [{'account_id': 'account', 'last_game_id': '2'}])
+    for game_id in (1, 2):
+        db.api.cache.put('match', game_id, {'gameId': game_id})
+
+    assert db.rekey_games('NA1') == 1
+    first, second = api.namespace_game_id('NA1', 1), api.namespace_game_id('NA1', 2)
+    with db.engine.connect() as connection:
+        assert connection.execute(database.select(database.Match.game_id)).scalars().all() == [first]
+        assert set(connection.execute(database.select(database.Stats.game_id)).scalars()) == {first}
+        assert set(connection.execute(database.select(database.MatchFeature.game_id)).scalars()) == {first}
+        assert set(connection.execute(database.select(database.TimelineParticipant.game_id)).scalars()) == {first}
+        assert sorted(connection.execute(database.select(database.IngestionJob.game_id)).scalars()) == sorted([str(first), str(second)])
+        assert connection.execute(database.select(database.SyncState.last_game_id)).scalar() == str(second)
+    assert db.api.cache.get('match', first) == {'gameId': 1}
+    assert db.api.cache.get('match', second) == {'gameId': 2}
+    assert db.api.cache.get('match', 1) is None
+    # re-keyed databases are left alone
+    assert db.rekey_games('NA1') == 0
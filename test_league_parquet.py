@@ -0,0 +1,32 @@
+import pandas as pd
+from sqlalchemy import create_engine
+import league_api as api
+import league_database as database
+from league_mock import generate_match, generate_timeline
+from league_parquet import ParquetStore
+
+
+def test_export_round_trip(tmp_path):
+    engine = create_engine('sqlite:///' + str(tmp_path / 'league.db'))
+    database.Base.metadata.create_all(engine)
+    riot = api.RiotApi('test')
+    writer = database.BulkWriter(engine)
+    for game_id in (1, 2, 3):
+        frames = riot.parse_match_details(generate_match(game_id))
+        frames.update(riot.parse_timeline(game_id, generate_timeline(game_id, minutes=20)))
+        database.denormalize_timelines(frames)
+        writer.add(frames)
+    writer.flush()
+
+    store = ParquetStore(str(tmp_path / 'parquet'))
+    assert store.export(engine) == 3
+    assert store.game_ids() == {1, 2, 3}
+    # enum columns are stored as their labels
+    stats = store.read('stats').sort_values(['game_id', 'participant_id'])
+    expected = pd.read_sql(sql='SELECT game_id, participant_id, role, lane FROM stats ORDER BY game_id, participant_id', con=engine)
+    assert list(stats.role) == list(expected.role)
+    assert list(stats.lane) == list(expected.lane)
+    events = store.read('timeline_events', columns=['game_id', 'type'])
+    assert len(events) == pd.read_sql(sql='SELECT COUNT(*) AS events FROM timeline_events', con=engine).events[0]
+    # exported matches are skipped by the next export
+    assert store.export(engine) == 0